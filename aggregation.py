@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+import functions as f
+
+# The periods supported by aggregate_measurements
+PERIODS = ["hour", "day", "month", "hour of the day"]
+
+
+def add_buckets(table, delta):
+    """
+    Add aggregated values to a table of buckets. Existing buckets are updated in place and
+    new buckets are inserted, so only the buckets in delta are touched
+
+    Args:
+        table (pandas DataFrame object): sums or counts indexed by bucket key
+        delta (pandas DataFrame object): sums or counts of new measurements indexed by bucket key
+    Return:
+        (pandas DataFrame object): the updated table
+    """
+    existing = delta.index.isin(table.index)
+    if existing.any():
+        table.loc[delta.index[existing]] += delta[existing]
+    if not existing.all():
+        table = pd.concat([table, delta[~existing]])
+        # Rows are normally appended in time order, so sorting is rarely needed
+        if not table.index.is_monotonic_increasing:
+            table = table.sort_index()
+    return table
+
+
+class AggregationEngine:
+    """
+    Computes the hour, day, month and hour of the day aggregates of a dataset from one scan.
+
+    The raw measurements are only grouped once, into hourly sums and counts. Days are summed
+    from the hours, months from the days and the hour of the day means from the hourly sums
+    and counts. Every result is kept, so asking for the same period again costs nothing.
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+    """
+
+    def __init__(self, timestamps, data):
+        # The only pass over the raw measurements
+        self.hour_sum, self.hour_count = self.group_hours(timestamps, data)
+        self._day_sum = None
+        self._month_sum = None
+        self._results = {}
+
+    @staticmethod
+    def group_hours(timestamps, data):
+        """
+        Sum and count measurements per hour
+
+        Args:
+            timestamps (pandas DatetimeIndex object): N timestamps
+            data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        Return:
+            tuple: sums and counts of non-missing values, indexed by hours since 1970
+        """
+        grouped = data.groupby(f.period_keys(pd.DatetimeIndex(timestamps), "hour"))
+        return (grouped.sum(), grouped.count())
+
+    @staticmethod
+    def days_to_months(day_sum):
+        """Sum daily sums (indexed by days since 1970) per month since 1970"""
+        days = day_sum.index.to_numpy().astype("datetime64[D]")
+        return day_sum.groupby(days.astype("datetime64[M]").view(np.int64)).sum()
+
+    def update(self, timestamps, data):
+        """
+        Add new measurements to the aggregates. Only the hours, days and months that contain
+        new measurements are touched, so the cost depends on the size of the new data only
+
+        Args:
+            timestamps (pandas DatetimeIndex object): timestamps of the new measurements
+            data (pandas DataFrame object): the new measurements
+        """
+        if len(data) == 0:
+            return
+        hour_sum, hour_count = self.group_hours(timestamps, data)
+        self.hour_sum = add_buckets(self.hour_sum, hour_sum)
+        self.hour_count = add_buckets(self.hour_count, hour_count)
+
+        # Sums are additive, so the coarser tiers are updated with the sums of the new data
+        if self._day_sum is not None or self._month_sum is not None:
+            day_sum = hour_sum.groupby(hour_sum.index.to_numpy() // 24).sum()
+            if self._day_sum is not None:
+                self._day_sum = add_buckets(self._day_sum, day_sum)
+            if self._month_sum is not None:
+                self._month_sum = add_buckets(self._month_sum, self.days_to_months(day_sum))
+
+        # Drop the memoized results, they are rebuilt from the updated tiers on request
+        self._results = {}
+
+    def merge(self, other):
+        """
+        Add the aggregates of another dataset, e.g. another meter file of the same site
+
+        Args:
+            other (AggregationEngine): the aggregates to add to these
+        Return:
+            (AggregationEngine): this engine
+        """
+        self.hour_sum = add_buckets(self.hour_sum, other.hour_sum)
+        self.hour_count = add_buckets(self.hour_count, other.hour_count)
+        # The coarser tiers are derived again from the merged hours on request
+        self._day_sum = None
+        self._month_sum = None
+        self._results = {}
+        return self
+
+    @property
+    def day_sum(self):
+        """Sum per day, indexed by days since 1970. Derived from the hourly sums"""
+        if self._day_sum is None:
+            self._day_sum = self.hour_sum.groupby(self.hour_sum.index.to_numpy() // 24).sum()
+        return self._day_sum
+
+    @property
+    def month_sum(self):
+        """Sum per month, indexed by months since 1970. Derived from the daily sums"""
+        if self._month_sum is None:
+            self._month_sum = self.days_to_months(self.day_sum)
+        return self._month_sum
+
+    def hour_of_day_mean(self):
+        """
+        Mean per hour of the day, computed from the hourly sums and counts
+
+        Return:
+            (pandas DataFrame object): 24 x 4 matrix (fewer rows if some hours have no data)
+        """
+        hour_of_day = self.hour_sum.index.to_numpy() % 24
+        mean = self.hour_sum.groupby(hour_of_day).sum() / self.hour_count.groupby(hour_of_day).sum()
+        mean.index.name = "hour"
+        return mean
+
+    def aggregate(self, period):
+        """
+        Aggregate the dataset. Same result as aggregate_measurements with a DatetimeIndex
+
+        Args:
+            period (Str): "hour", "day", "month" or "hour of the day"
+        Return:
+            tuple: the start of each period (DatetimeIndex) and the aggregated data (DataFrame)
+        """
+        if period not in self._results:
+            if period == "hour of the day":
+                data_a = self.hour_of_day_mean()
+                # Each hour of the day is placed on the first hour with data at that time of day
+                hours = self.hour_sum.index.to_numpy()
+                first = pd.Series(hours).groupby(hours % 24).min()
+                timestamps = f.period_start(first[data_a.index].to_numpy(), "hour")
+            else:
+                sums = {"hour": self.hour_sum, "day": self.day_sum, "month": self.month_sum}[period]
+                data_a = sums.reset_index(drop=True)
+                timestamps = f.period_start(sums.index.to_numpy(), period)
+            self._results[period] = (timestamps, data_a)
+        return self._results[period]
+
+    def aggregate_all(self):
+        """
+        Aggregate the dataset by every period
+
+        Return:
+            (dict): the result of aggregate for each period
+        """
+        return {period: self.aggregate(period) for period in PERIODS}
@@ -0,0 +1,305 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import functions as f
+from query import read_range
+from rendering import plot_line
+
+# Number of rows in a rolling window (an hour of minute data)
+WINDOW = 60
+
+# A measurement is a peak when it is this many standard deviations above the mean of the window before it
+Z_THRESHOLD = 4.0
+
+# Shortest run of zero measurements reported as a dead meter (an hour of minute data)
+MIN_ZERO_RUN = 60
+
+# Shortest run of corrupt measurements reported. Single corrupt measurements are only counted
+# (see load_measurements)
+MIN_CORRUPT_RUN = 10
+
+# Windows with a rolling standard deviation below this fraction of the largest value of the zone are
+# checked for equal values. The rolling sums round the variance to about 1e-16 times the squared values,
+# i.e. a standard deviation of about 1e-8 times the values, so constant windows are always below it
+CONSTANT_TOLERANCE = 1e-6
+
+
+def constant_windows(values, last, window):
+    """
+    Find the windows whose valid values are all equal. A window is constant if the last change between
+    consecutive valid values is at or before its first valid value, so the test is exact
+
+    Args:
+        values (numpy array): N x Z matrix
+        last (numpy array): N x Z matrix, the last valid value at or before each row (see functions.fill_forward)
+        window (int): number of rows in the window ending at each row
+    Return:
+        (numpy array): N x Z boolean matrix, True where the window has valid values and they are equal
+    """
+    n = len(values)
+    valid = ~np.isnan(values)
+    rows = np.arange(n)[:, None]
+    # A change is a valid value that differs from the valid value before it
+    changes = np.zeros(values.shape, dtype=bool)
+    changes[1:] = valid[1:] & ~np.isnan(last[:-1]) & (values[1:] != last[:-1])
+    last_change = np.maximum.accumulate(np.where(changes, rows, -1), axis=0)
+    next_valid = np.minimum.accumulate(np.where(valid, rows, n)[::-1], axis=0)[::-1]
+    first = next_valid[np.maximum(rows[:, 0] - window + 1, 0)]
+    return (first <= rows) & (last_change <= first)
+
+
+def rolling_moments(values, window, min_periods=None):
+    """
+    Compute the rolling mean and standard deviation of each column with DataFrame.rolling. NaN values
+    are skipped. The rolling sums leave a rounding error in windows of equal values, e.g. a dead meter,
+    so those windows get a standard deviation of exactly 0 and their value as the mean (see
+    CONSTANT_TOLERANCE and constant_windows)
+
+    Args:
+        values (numpy array): N x Z matrix
+        window (int): number of rows in the window ending at each row
+        min_periods (int): number of valid values a window needs. Default is window
+    Return:
+        (tuple): the N x Z rolling mean and standard deviation, NaN where a window has too few values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rolling = pd.DataFrame(values).rolling(window, min_periods=min_periods)
+    mean = rolling.mean().to_numpy(copy=True)
+    std = rolling.std().to_numpy(copy=True)
+    if values.size == 0:
+        return (mean, std)
+
+    # Only the zones with a window of (almost) no spread can have a constant window
+    zones = np.flatnonzero((std <= CONSTANT_TOLERANCE * np.fmax.reduce(np.abs(values), axis=0)).any(axis=0))
+    if len(zones):
+        subset = values[:, zones]
+        last = f.fill_forward(subset, np.isnan(subset))
+        constant = constant_windows(subset, last, window)
+        mean[:, zones] = np.where(constant & ~np.isnan(mean[:, zones]), last, mean[:, zones])
+        std[:, zones] = np.where(constant & ~np.isnan(std[:, zones]), 0.0, std[:, zones])
+    return (mean, std)
+
+
+def zscores(values, window, min_periods=None, moments=None):
+    """
+    Compute how many standard deviations each measurement is from the mean of the window of rows before it
+
+    Args:
+        values (numpy array): N x Z matrix
+        window (int): number of rows in the window
+        min_periods (int): number of valid values a window needs
+        moments (tuple): the rolling_moments of values with the same window, if they are already computed
+    Return:
+        (numpy array): N x Z z-scores. inf after a window of constant measurements, NaN for the first rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    mean, std = rolling_moments(values, window, min_periods) if moments is None else moments
+    # The window of each row ends at the row before it, so a spike does not hide itself
+    z = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(values[1:] - mean[:-1], std[:-1], out=z[1:])
+    return z
+
+
+def find_runs(mask, min_length=1):
+    """
+    Find the runs of True values in each column in O(N)
+
+    Args:
+        mask (numpy array): N x Z boolean matrix
+        min_length (int): shortest run reported
+    Return:
+        (tuple): column, first row and length of each run, ordered by column and row
+    """
+    n, m = mask.shape
+    # Pad every column with False on both sides, so every run has a start and an end
+    padded = np.zeros((m, n + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask.T
+    edges = np.diff(padded, axis=1)
+    columns, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    lengths = ends - starts
+    keep = lengths >= min_length
+    return (columns[keep], starts[keep], lengths[keep])
+
+
+def runs_table(timestamps, columns, mask, min_length=1):
+    """
+    Find the runs of True values in each zone
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        columns (list): the zone of each column of mask
+        mask (numpy array): N x Z boolean matrix
+        min_length (int): shortest run reported
+    Return:
+        (pandas DataFrame object): the zone, first and last time and number of rows of each run
+    """
+    zone, first, length = find_runs(mask, min_length)
+    return pd.DataFrame({"zone": np.asarray(columns, dtype=object)[zone], "start": timestamps[first],
+                         "end": timestamps[first + length - 1], "rows": length})
+
+
+def zero_runs(timestamps, data, min_length=MIN_ZERO_RUN):
+    """
+    Find runs of zero measurements in each zone, e.g. dead meters
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        data (pandas DataFrame object): N x Z matrix. Each row is a set of measurements
+        min_length (int): shortest run reported
+    Return:
+        (pandas DataFrame object): the runs (see runs_table)
+    """
+    return runs_table(pd.DatetimeIndex(timestamps), list(data.columns), data.to_numpy() == 0, min_length)
+
+
+def corruption_runs(filename, min_length=MIN_CORRUPT_RUN, start=None, end=None, zones=None):
+    """
+    Find runs of corrupt measurements (-1) in each zone of a data file. The runs are found in the
+    raw rows, before load_measurements fills or drops them
+
+    Args:
+        filename (str): the name of the data file, a csv file or a binary archive
+        min_length (int): shortest run reported
+        start (str or datetime): first time included
+        end (str or datetime): first time excluded
+        zones (list): the zones to search (see functions.zone_columns)
+    Return:
+        (pandas DataFrame object): the runs (see runs_table)
+    """
+    df = read_range(filename, start, end, zones)
+    columns = list(df.columns[6:])
+    return runs_table(f.time_index(df[f.TIME_COLUMNS]), columns, df[columns].to_numpy() == -1, min_length)
+
+
+class Anomalies:
+    """
+    Rolling mean and standard deviation, z-score peaks and runs of zero measurements of each zone,
+    optionally with the runs of corrupt measurements of the source file.
+
+    Every statistic is computed with cumulative sums or differences of the whole matrix, so the
+    cost is O(N) for any window. Works on the measurements or on aggregated measurements,
+    where the window is then counted in hours, days or months.
+
+    Args:
+        timestamps (pandas DatetimeIndex object or DataFrame): N timestamps or the N x 6 time matrix
+        data (pandas DataFrame object): N x Z matrix. Each row is a set of measurements
+        window (int): number of rows in the rolling window
+        threshold (float): z-score above which a measurement is a peak
+        min_zero_run (int): shortest run of zero measurements reported
+        corruption (pandas DataFrame object): runs of corrupt measurements (see corruption_runs)
+    """
+
+    def __init__(self, timestamps, data, window=WINDOW, threshold=Z_THRESHOLD, min_zero_run=MIN_ZERO_RUN,
+                 corruption=None):
+        self.timestamps = f.time_index(timestamps)
+        self.columns = list(data.columns)
+        self.window = window
+        self.threshold = threshold
+
+        values = data.to_numpy(np.float64)
+        mean, std = rolling_moments(values, window)
+        self.mean = pd.DataFrame(mean, index=data.index, columns=self.columns)
+        self.std = pd.DataFrame(std, index=data.index, columns=self.columns)
+        self.zscore = pd.DataFrame(zscores(values, window, moments=(mean, std)), index=data.index,
+                                   columns=self.columns)
+
+        # Peaks ordered by zone and time
+        zone, row = np.nonzero(self.zscore.to_numpy().T > threshold)
+        self.peaks = pd.DataFrame({"zone": np.asarray(self.columns, dtype=object)[zone],
+                                   "time": self.timestamps[row], "row": row, "value": values[row, zone],
+                                   "zscore": self.zscore.to_numpy()[row, zone]})
+        self.zero_runs = zero_runs(self.timestamps, data, min_zero_run)
+        self.corruption_runs = corruption
+
+    def summary(self):
+        """
+        Count the peaks and runs of each zone
+
+        Return:
+            (pandas DataFrame object): one row per zone
+        """
+        table = pd.DataFrame(index=self.columns)
+        table["peaks"] = self.peaks["zone"].value_counts()
+        table["max z-score"] = self.peaks.groupby("zone")["zscore"].max()
+        table["zero runs"] = self.zero_runs["zone"].value_counts()
+        table["longest zero run"] = self.zero_runs.groupby("zone")["rows"].max()
+        if self.corruption_runs is not None:
+            table["corrupt runs"] = self.corruption_runs["zone"].value_counts()
+            table["longest corrupt run"] = self.corruption_runs.groupby("zone")["rows"].max()
+        counts = [column for column in table.columns if column != "max z-score"]
+        table[counts] = table[counts].fillna(0).astype(np.int64)
+        return table
+
+    def export(self, directory, name, scale=1):
+        """
+        Write the rolling statistics, peaks and runs as csv files
+
+        Args:
+            directory (str): the output directory
+            name (str): the start of the file names
+            scale (int): number of Wh per display unit of the rolling statistics and peak values
+        Return:
+            (list): the names of the written files
+        """
+        os.makedirs(directory, exist_ok=True)
+        rolling = pd.concat([self.mean.add_prefix("mean "), self.std.add_prefix("std ")], axis=1) / scale
+        rolling = rolling.set_axis(self.timestamps)
+        peaks = self.peaks.drop(columns="row")
+        peaks["value"] /= scale
+        tables = {"rolling": rolling, "peaks": peaks.set_index("time"), "zero_runs": self.zero_runs}
+        if self.corruption_runs is not None:
+            tables["corruption_runs"] = self.corruption_runs
+
+        written = []
+        for table_name, table in tables.items():
+            written.append(os.path.join(directory, "{}_{}.csv".format(name, table_name)))
+            table.to_csv(written[-1], index=table_name in ["rolling", "peaks"])
+        return written
+
+    def draw(self, ax, column=None, combined=None, downsample=None):
+        """
+        Overlay the rolling mean, the peaks and the runs on a plot of visualize
+
+        Args:
+            ax (matplotlib Axes object): the plot
+            column (str): the zone of the plot. None for the plot of the combined zones, which
+                marks the peaks and runs of every zone
+            combined (numpy array): the plotted sum of the zones, used for the combined plot
+            downsample (bool): reduce the rolling mean like the plotted line
+        """
+        import matplotlib.dates as md
+
+        # The overlay does not change the range of the plot
+        limits = ax.get_xlim()
+        dates = self.timestamps.to_numpy()
+        if column is None:
+            peaks = self.peaks.drop_duplicates("row")
+            ax.scatter(dates[peaks["row"].to_numpy()], combined[peaks["row"].to_numpy()], color="black",
+                       marker="^", s=12, zorder=3, label="peaks")
+        else:
+            plot_line(ax, dates, self.mean[column].to_numpy(), downsample, color="black", linewidth=0.8,
+                      alpha=0.6, label="rolling mean")
+            peaks = self.peaks[self.peaks["zone"] == column]
+            ax.scatter(peaks["time"].to_numpy(), peaks["value"].to_numpy(), color="black", marker="^", s=12,
+                       zorder=3, label="peaks")
+
+        # Each kind of run is drawn as one collection of spans
+        runs = [(self.zero_runs, "grey", "zero runs")]
+        if self.corruption_runs is not None:
+            runs.append((self.corruption_runs, "orange", "corrupt runs"))
+        for table, color, label in runs:
+            if column is not None:
+                table = table[table["zone"] == column]
+            if len(table) == 0:
+                continue
+            # A run covers at least a minute, so runs of a single row are still visible
+            starts = md.date2num(table["start"].to_numpy())
+            widths = np.maximum(md.date2num(table["end"].to_numpy()) - starts, 1 / (24 * 60))
+            ax.broken_barh(list(zip(starts, widths)), (0, 1), transform=ax.get_xaxis_transform(), color=color,
+                           alpha=0.3, label=label)
+        ax.set_xlim(limits)
+        ax.legend(fontsize=6, loc="upper right")
@@ -0,0 +1,179 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import functions as f
+
+# First bytes of every archive file
+MAGIC = b"METERARC"
+
+# Suffix of the archive files written by convert_csv
+ARCHIVE_SUFFIX = ".mtr"
+
+# One fixed-size record per row: the time in nanoseconds since the epoch and the four zones.
+# Corrupt measurements are kept as -1, like in the csv files
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("zones", "<f4", (4,))])
+
+
+def is_archive(filename):
+    """
+    Check if a data file is a binary archive instead of a csv file
+
+    Args:
+        filename (str): the name of the data file
+    Return:
+        (bool): True if the file starts with the archive header
+    """
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def convert_csv(filename, output=None, chunksize=1_000_000):
+    """
+    Convert a csv meter file into a binary archive. The file is streamed in chunks,
+    so files larger than memory can be converted
+
+    Args:
+        filename (str): the name of the csv file
+        output (str): the name of the archive. Default is the csv file name with the .mtr suffix
+        chunksize (int): number of rows converted at a time
+    Return:
+        (tuple): the name of the archive and the number of rows written
+    """
+    if output is None:
+        output = os.path.splitext(filename)[0] + ARCHIVE_SUFFIX
+
+    rows = 0
+    last = np.iinfo(np.int64).min
+    # Write to a temporary file first so a failed conversion never leaves a half written archive
+    temporary = output + ".tmp"
+    try:
+        with open(temporary, "wb") as file:
+            file.write(MAGIC)
+            reader = pd.read_csv(filename, header=None, names=f.COLUMNS, dtype=f.CHUNK_DTYPES, chunksize=chunksize)
+            for chunk in reader:
+                records = np.empty(len(chunk), dtype=RECORD_DTYPE)
+                records["timestamp"] = f.time_index(chunk[f.TIME_COLUMNS]).asi8
+                records["zones"] = chunk[f.ZONE_COLUMNS].to_numpy()
+                # Time-range slicing uses binary search, so the rows must be in time order
+                if records["timestamp"][0] < last or np.any(np.diff(records["timestamp"]) < 0):
+                    raise ValueError("{} is not sorted by time".format(filename))
+                last = records["timestamp"][-1]
+                file.write(records.tobytes())
+                rows += len(records)
+        os.replace(temporary, output)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return (output, rows)
+
+
+class MeterArchive:
+    """
+    A binary archive opened as a read-only memory map.
+
+    Opening does not read the records. The arrays are views of the file, and time ranges are
+    found by binary search on the sorted timestamps, so only the pages of the requested rows are read.
+
+    Args:
+        filename (str): the name of the archive
+    """
+
+    def __init__(self, filename):
+        if not is_archive(filename):
+            raise ValueError("{} is not a meter archive".format(filename))
+        self.filename = filename
+        size = os.path.getsize(filename) - len(MAGIC)
+        if size % RECORD_DTYPE.itemsize != 0:
+            raise ValueError("{} is truncated".format(filename))
+        if size == 0:
+            # A memory map can not be empty
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+        else:
+            self.records = np.memmap(filename, dtype=RECORD_DTYPE, mode="r", offset=len(MAGIC))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        """The int64 timestamps of the rows in nanoseconds since the epoch, as a view of the file"""
+        return self.records["timestamp"]
+
+    @property
+    def zones(self):
+        """The N x 4 float32 measurements, as a view of the file"""
+        return self.records["zones"]
+
+    def locate(self, start=None, end=None):
+        """
+        Find the rows of a time range by binary search
+
+        Args:
+            start (str or datetime): first time included. Default is the first row
+            end (str or datetime): first time excluded. Default is after the last row
+        Return:
+            (slice): the positions of the rows from start up to, but not including, end
+        """
+        first = 0 if start is None else np.searchsorted(self.timestamps, pd.Timestamp(start).value, "left")
+        last = len(self) if end is None else np.searchsorted(self.timestamps, pd.Timestamp(end).value, "left")
+        return slice(int(first), int(max(first, last)))
+
+    def frame(self, start=None, end=None, zones=None):
+        """
+        Read a time range in the N x 10 layout of the csv files, with the corrupt measurements still -1
+
+        Args:
+            start (str or datetime): first time included
+            end (str or datetime): first time excluded
+            zones (list): the zones to read (see functions.zone_columns). Default is every zone
+        Return:
+            (pandas DataFrame object): time columns and float32 zones of the rows in the range,
+                indexed by row number in the archive
+        """
+        rows = self.locate(start, end)
+        records = self.records[rows]
+        columns = f.zone_columns(zones)
+        df = f.time_matrix(records["timestamp"].view("datetime64[ns]"), pd.RangeIndex(rows.start, rows.stop))
+        df[columns] = records["zones"][:, [f.ZONE_COLUMNS.index(column) for column in columns]]
+        return df
+
+    def measurements(self, start=None, end=None):
+        """
+        Read a time range as tvec and data without cleaning it
+
+        Args:
+            start (str or datetime): first time included
+            end (str or datetime): first time excluded
+        Return:
+            (tuple): tvec (N x 6 matrix) and data (N x 4 matrix, a view of the file)
+        """
+        rows = self.locate(start, end)
+        records = self.records[rows]
+        index = pd.RangeIndex(rows.start, rows.stop)
+        tvec = f.time_matrix(records["timestamp"].view("datetime64[ns]"), index)
+        data = pd.DataFrame(records["zones"], index=index, columns=f.ZONE_COLUMNS, copy=False)
+        return (tvec, data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert csv meter files into memory-mapped binary archives")
+    parser.add_argument("files", nargs="+", help="csv files to convert")
+    parser.add_argument("--output-dir", help="directory of the archives. Default is next to each csv file")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="number of rows converted at a time")
+    args = parser.parse_args(argv)
+
+    for filename in args.files:
+        output = None
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(filename))[0] + ARCHIVE_SUFFIX
+            output = os.path.join(args.output_dir, name)
+        output, rows = convert_csv(filename, output, args.chunksize)
+        print("Wrote {} ({} rows)".format(output, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import copy
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from aggregation import PERIODS
+from measurements import load_dataset
+from streaming_stats import compute_statistics
+
+# Command line names of the data processing options and aggregation periods
+FMODES = {"ffill": "forward fill", "bfill": "backward fill", "drop": "drop", "linear": "linear",
+          "zone-fill": "zone fill"}
+PERIOD_NAMES = {"hour": "hour", "day": "day", "month": "month", "hour-of-day": "hour of the day"}
+
+
+class FileResult:
+    """
+    The result of processing one meter file in a worker process
+
+    Args:
+        filename (str): the name of the data file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self.seconds = 0.0
+        self.engine = None
+        self.statistics = None
+        self.error = None
+
+
+def expand_sources(sources):
+    """
+    Find the meter files of a list of files, directories and glob patterns
+
+    Args:
+        sources (list): file names, directories (all .csv files in them) or glob patterns
+    Return:
+        (list): the sorted file names
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(glob.glob(os.path.join(source, "*.csv")))
+        elif os.path.isfile(source):
+            files.append(source)
+        else:
+            files.extend(glob.glob(source, recursive=True))
+    return sorted(set(files))
+
+
+def process_file(filename, fmode, exact=False, error=0.01, chunksize=None):
+    """
+    Load one meter file and compute its aggregates and statistics. Runs in a worker process
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        exact (bool): compute exact quartiles
+        error (float): target rank error of the estimated quartiles
+        chunksize (int): stream the file in chunks of this many rows
+    Return:
+        (FileResult): the aggregates, statistics and timing of the file, or the error it raised
+    """
+    result = FileResult(filename)
+    start = time.perf_counter()
+    try:
+        dataset = load_dataset(filename, fmode, chunksize=chunksize)
+        result.rows = len(dataset)
+        # The hourly tier is enough to derive every period after merging
+        result.engine = dataset.engine
+        result.statistics = compute_statistics(dataset.data, exact, error)
+    except Exception as e:
+        result.error = "{}: {}".format(type(e).__name__, e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def process_files(files, fmode, workers=None, exact=False, error=0.01, chunksize=None, progress=None):
+    """
+    Process meter files in parallel across a pool of worker processes
+
+    Args:
+        files (list): the names of the data files
+        fmode (str): the requested data processing
+        workers (int): number of worker processes. Default is the number of cores
+        exact (bool): compute exact quartiles
+        error (float): target rank error of the estimated quartiles
+        chunksize (int): stream the files in chunks of this many rows
+        progress (function): called with each FileResult as soon as it is done
+    Return:
+        (list): a FileResult per file, in the order of files
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, filename, fmode, exact, error, chunksize) for filename in files]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.filename] = result
+            if progress is not None:
+                progress(result)
+    return [results[filename] for filename in files]
+
+
+def merge_results(results, key=None):
+    """
+    Combine the aggregates and statistics of several files
+
+    Args:
+        results (list): FileResult objects
+        key (function): maps a file name to a group, e.g. its site. Default combines all files
+    Return:
+        (dict): (engine, statistics) per group. Files that failed are left out
+    """
+    merged = {}
+    for result in results:
+        if result.error is not None:
+            continue
+        group = key(result.filename) if key is not None else "all"
+        if group not in merged:
+            # Copy so the results of the first file are not changed by the merge
+            merged[group] = (copy.deepcopy(result.engine), copy.deepcopy(result.statistics))
+        else:
+            merged[group][0].merge(result.engine)
+            merged[group][1].merge(result.statistics)
+    return merged
+
+
+def write_aggregates(engine, statistics, directory, periods):
+    """
+    Write aggregates and statistics as csv files
+
+    Args:
+        engine (AggregationEngine): the aggregates
+        statistics (StreamingStatistics): the statistics
+        directory (str): the output directory
+        periods (list): the aggregation periods to write
+    """
+    os.makedirs(directory, exist_ok=True)
+    for period in periods:
+        timestamps, data_a = engine.aggregate(period)
+        table = data_a.set_axis(timestamps if period != "hour of the day" else data_a.index)
+        table.to_csv(os.path.join(directory, "{}.csv".format(period.replace(" ", "_"))))
+    statistics.table().to_csv(os.path.join(directory, "statistics.csv"))
+
+
+def print_report(results):
+    """Print the rows, time and status of each file and the total throughput"""
+    print("{:<40} {:>12} {:>10} {:>14}  {}".format("File", "Rows", "Seconds", "Rows/sec", "Status"))
+    for result in results:
+        rate = result.rows / result.seconds if result.seconds > 0 else 0
+        print("{:<40} {:>12} {:>10.3f} {:>14.0f}  {}".format(
+            os.path.basename(result.filename)[:40], result.rows, result.seconds, rate, result.error or "ok"))
+    failed = sum(result.error is not None for result in results)
+    print("\n{} files, {} failed, {} rows".format(len(results), failed, sum(result.rows for result in results)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and aggregate many meter files in parallel")
+    parser.add_argument("sources", nargs="+", help="meter files, directories or glob patterns")
+    parser.add_argument("--fmode", choices=FMODES, default="drop", help="handling of corrupted data")
+    parser.add_argument("--period", choices=PERIOD_NAMES, action="append",
+                        help="aggregation period to write (repeatable). Default is every period")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=None, help="stream files in chunks of this many rows")
+    parser.add_argument("--exact", action="store_true", help="compute exact quartiles")
+    parser.add_argument("--error", type=float, default=0.01, help="rank error of the estimated quartiles")
+    parser.add_argument("--by-directory", action="store_true", help="merge files per directory (site)")
+    parser.add_argument("--output", help="directory to write aggregates and statistics to")
+    args = parser.parse_args(argv)
+
+    files = expand_sources(args.sources)
+    if not files:
+        parser.error("no meter files found")
+    periods = [PERIOD_NAMES[period] for period in args.period] if args.period else PERIODS
+
+    start = time.perf_counter()
+    results = process_files(files, FMODES[args.fmode], args.workers, args.exact, args.error, args.chunksize)
+    print_report(results)
+    print("Wall time: {:.3f} s".format(time.perf_counter() - start))
+
+    key = (lambda filename: os.path.basename(os.path.dirname(os.path.abspath(filename)))) if args.by_directory else None
+    for group, (engine, statistics) in merge_results(results, key).items():
+        print("\nStatistics ({})\n".format(group))
+        print(statistics.table().iloc[:, 3:])
+        if args.output:
+            directory = os.path.join(args.output, group) if args.by_directory else args.output
+            write_aggregates(engine, statistics, directory, periods)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+import functions as f
+from aggregation import PERIODS, AggregationEngine
+from fast_csv import ENGINES, read_meter_csv
+from generate_data import generate_measurements
+
+# Data processing options benchmarked for load_measurements
+FMODES = ["forward fill", "backward fill", "drop", "linear", "zone fill"]
+
+# Default number of rows of the benchmark files. Larger files (up to 10 ** 8 rows, about 4.5 GB) are
+# benchmarked with --sizes
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+# Files with more rows than this only benchmark the chunked loader. The parsers, the in-memory loads
+# (timed and then traced for every fmode), the aggregations, the statistics and the plots of such a file
+# would need several copies of it in memory
+IN_MEMORY_ROWS = 10 ** 7
+
+# Chunk size of the chunked loader
+CHUNK_SIZE = 1_000_000
+
+
+def measure(function, *args, memory=True, **kwargs):
+    """
+    Time a function call and measure its peak memory use
+
+    The memory is measured with tracemalloc in a second call, so it does not slow down the timed call.
+
+    Args:
+        function (function): the function to call
+        *args: arguments of the function
+        memory (bool): measure peak memory
+        **kwargs: keyword arguments of the function
+    Return:
+        (tuple): the result of the timed call, the seconds it took and the peak memory in bytes (or None)
+    """
+    # Hide the warnings printed by the functions
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        peak = None
+        if memory:
+            tracemalloc.start()
+            function(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return (result, seconds, peak)
+
+
+def benchmark_file(filename, rows, memory=True, plot=True, chunksize=None):
+    """
+    Benchmark every stage of the pipeline on one file
+
+    Args:
+        filename (str): the name of the data file
+        rows (int): number of rows in the file
+        memory (bool): measure peak memory
+        plot (bool): include visualize (rendered to a file)
+        chunksize (int): also benchmark the chunked loader with this chunk size. Files of more than
+            IN_MEMORY_ROWS rows only benchmark the chunked loader, with CHUNK_SIZE if chunksize is not given
+    Return:
+        (list): a result dict per stage
+    """
+    results = []
+
+    def record(stage, option, seconds, peak):
+        results.append({"stage": stage, "option": option, "rows": rows, "seconds": seconds,
+                        "rows_per_sec": rows / seconds if seconds > 0 else None,
+                        "peak_mb": peak / 1024 ** 2 if peak is not None else None})
+
+    if rows > IN_MEMORY_ROWS:
+        def load_rows(fmode):
+            # Only the number of rows is kept, so the timed and the traced loads are never in memory together
+            return len(f.load_measurements(filename, fmode, chunksize=chunksize or CHUNK_SIZE)[1])
+
+        for fmode in FMODES:
+            _, seconds, peak = measure(load_rows, fmode, memory=memory)
+            record("load_measurements (chunked)", fmode, seconds, peak)
+        return results
+
+    # Baseline of the parse engines: pd.read_csv with type inference, as load_measurements reads by default
+    _, seconds, peak = measure(pd.read_csv, filename, header=None, memory=memory)
+    record("pd.read_csv", "inferred types", seconds, peak)
+
+    for engine in ENGINES:
+        try:
+            _, seconds, peak = measure(read_meter_csv, filename, engine, memory=memory)
+        except ImportError:
+            # pyarrow is optional
+            continue
+        record("read_meter_csv", engine, seconds, peak)
+
+    for fmode in FMODES:
+        _, seconds, peak = measure(f.load_measurements, filename, fmode, memory=memory)
+        record("load_measurements", fmode, seconds, peak)
+        if chunksize:
+            _, seconds, peak = measure(f.load_measurements, filename, fmode, chunksize=chunksize, memory=memory)
+            record("load_measurements (chunked)", fmode, seconds, peak)
+
+    # The remaining stages use the data loaded with "drop"
+    with contextlib.redirect_stdout(io.StringIO()):
+        tvec, data = f.load_measurements(filename, "drop")
+    for period in PERIODS:
+        _, seconds, peak = measure(f.aggregate_measurements, tvec, data, period, memory=memory)
+        record("aggregate_measurements", period, seconds, peak)
+
+    timestamps = f.time_index(tvec)
+    _, seconds, peak = measure(lambda: AggregationEngine(timestamps, data).aggregate_all(), memory=memory)
+    record("AggregationEngine.aggregate_all", "all periods", seconds, peak)
+
+    _, seconds, peak = measure(f.print_statistics, tvec, data, memory=memory)
+    record("print_statistics", "default", seconds, peak)
+
+    if plot:
+        output = os.path.splitext(filename)[0] + ".png"
+        for zones in ["all", "each"]:
+            _, seconds, peak = measure(f.visualize, data, tvec, zones, "Wh", output=output, memory=memory)
+            record("visualize", zones, seconds, peak)
+    return results
+
+
+def print_results(results):
+    """Print the benchmark results as a table"""
+    print("{:<34} {:<16} {:>11} {:>10} {:>14} {:>10}".format("Stage", "Option", "Rows", "Seconds", "Rows/sec",
+                                                            "Peak MB"))
+    for result in results:
+        print("{:<34} {:<16} {:>11} {:>10.4f} {:>14} {:>10}".format(
+            result["stage"], result["option"], result["rows"], result["seconds"],
+            "{:.0f}".format(result["rows_per_sec"]) if result["rows_per_sec"] else "-",
+            "{:.1f}".format(result["peak_mb"]) if result["peak_mb"] is not None else "-"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic meter files")
+    parser.add_argument("--sizes", type=float, nargs="+", default=SIZES, help="numbers of rows, e.g. 1e3 1e8")
+    parser.add_argument("--corrupt-rate", type=float, default=0.01, help="fraction of corrupt measurements")
+    parser.add_argument("--data-dir", default="benchmark_data", help="directory of the generated files")
+    parser.add_argument("--output", default="benchmark_results.json", help="file to record the results in")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="chunk size of the chunked loader")
+    parser.add_argument("--clean-edges", action="store_true",
+                        help="keep the first and last rows valid, so forward and backward fill do not fall back to drop")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    parser.add_argument("--no-plot", action="store_true", help="do not benchmark visualize")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        rows = int(size)
+        edges = "clean" if args.clean_edges else "corrupt"
+        filename = os.path.join(args.data_dir, "meters_{}_{}_{}.csv".format(rows, args.corrupt_rate, edges))
+        # Generated files are kept for later runs. By default the first and last rows are corrupt
+        if not os.path.isfile(filename):
+            generate_measurements(filename, rows, args.corrupt_rate, corrupt_first=not args.clean_edges,
+                                  corrupt_last=not args.clean_edges, seed=rows)
+        results.extend(benchmark_file(filename, rows, not args.no_memory, not args.no_plot, args.chunksize))
+
+    print_results(results)
+    with open(args.output, "w") as file:
+        json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, file, indent=2)
+    print("\nResults recorded in {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# Name of the cache directory created next to the data files
+CACHE_DIR_NAME = ".meter_cache"
+
+# Arrays stored for every cache entry
+CACHE_PARTS = ["index", "tvec", "data", "counts"]
+
+# Array stored for entries of files that were only loaded up to their last complete line
+LINES_PART = "lines"
+
+
+def cache_key(filename, fmode):
+    """
+    Compute the cache key of a data file
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+    Return:
+        (tuple): the key of the file and fmode, and the key of the current state (size and mtime) of the file
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    source_key = hashlib.sha1("{}|{}".format(path, fmode).encode()).hexdigest()[:16]
+    state_key = hashlib.sha1("{}|{}".format(stat.st_size, stat.st_mtime_ns).encode()).hexdigest()[:16]
+    return (source_key, state_key)
+
+
+def cache_paths(filename, fmode, cache_dir=None):
+    """
+    Get the paths of the cached arrays of a data file
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        cache_dir (str): directory of the cache. Default is a .meter_cache directory next to the file
+    Return:
+        (dict): path of the .npy file for each of "index", "tvec", "data", "counts" and "lines"
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+    source_key, state_key = cache_key(filename, fmode)
+    prefix = os.path.join(cache_dir, "{}-{}-{}".format(os.path.basename(filename), source_key, state_key))
+    return {part: "{}.{}.npy".format(prefix, part) for part in CACHE_PARTS + [LINES_PART]}
+
+
+def remove_stale(filename, fmode, cache_dir=None):
+    """
+    Delete cache entries of a data file that were built from an older version of the file
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        cache_dir (str): directory of the cache
+    """
+    current = cache_paths(filename, fmode, cache_dir)
+    directory = os.path.dirname(current["data"])
+    if not os.path.isdir(directory):
+        return
+    source_key, _ = cache_key(filename, fmode)
+    entry = "{}-{}-".format(os.path.basename(filename), source_key)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(entry) and path not in current.values():
+            os.remove(path)
+
+
+def write_cache(filename, fmode, tvec, data, counts, cache_dir=None, lines=None):
+    """
+    Store the cleaned tvec and data of a data file as .npy arrays
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector
+        data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        counts (pandas Series object): number of corrupt measurements per zone
+        cache_dir (str): directory of the cache
+        lines (tuple): the number of bytes and rows of the file that were loaded, if only its
+            complete lines were loaded
+    """
+    paths = cache_paths(filename, fmode, cache_dir)
+    os.makedirs(os.path.dirname(paths["data"]), exist_ok=True)
+    remove_stale(filename, fmode, cache_dir)
+
+    arrays = {"index": data.index.to_numpy(), "tvec": tvec.to_numpy(), "data": data.to_numpy(),
+              "counts": counts.to_numpy()}
+    if lines is not None:
+        arrays[LINES_PART] = np.array(lines, dtype=np.int64)
+    for part in arrays:
+        # Write to a temporary file first so a crash never leaves a half written entry
+        temporary = paths[part] + ".tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, arrays[part])
+        os.replace(temporary, paths[part])
+
+
+def read_cache(filename, fmode, columns, cache_dir=None):
+    """
+    Open the cached tvec and data of a data file as memory-mapped DataFrames
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        columns (tuple): the column names of tvec and data
+        cache_dir (str): directory of the cache
+    Return:
+        (tuple): tvec and data as read-only DataFrames and the corrupt measurements per zone,
+            or None if there is no valid cache entry
+    """
+    paths = cache_paths(filename, fmode, cache_dir)
+    if not all(os.path.isfile(path) for path in paths.values()):
+        return None
+
+    index = pd.Index(np.load(paths["index"]))
+    # The arrays are memory-mapped, so the DataFrames do not copy them onto the heap
+    tvec = pd.DataFrame(np.load(paths["tvec"], mmap_mode="r"), index=index, columns=columns[0], copy=False)
+    data = pd.DataFrame(np.load(paths["data"], mmap_mode="r"), index=index, columns=columns[1], copy=False)
+    counts = pd.Series(np.load(paths["counts"]), index=columns[1])
+    return (tvec, data, counts)
+
+
+def read_lines(filename, fmode, cache_dir=None):
+    """
+    Get the complete lines that the cache entry of a data file was loaded from, without reading the file
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        cache_dir (str): directory of the cache
+    Return:
+        (tuple): the number of bytes and rows, or None if there is no valid cache entry with them
+    """
+    path = cache_paths(filename, fmode, cache_dir)[LINES_PART]
+    if not os.path.isfile(path):
+        return None
+    size, rows = np.load(path).tolist()
+    return (size, rows)
@@ -0,0 +1,124 @@
+import argparse
+import os
+
+import instrumentation
+from batch import FMODES
+from fast_csv import ENGINES
+from pipeline import BACKENDS, Pipeline
+
+# Command line names of the aggregation periods
+PERIOD_NAMES = {"minute": "minute", "hour": "hour", "day": "day", "month": "month",
+                "hour-of-day": "hour of the day"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Electricity consumption statistics, plots and exports")
+    parser.add_argument("files", nargs="+", help="meter csv files")
+    parser.add_argument("--fmode", choices=FMODES, default="drop", help="handling of corrupted data")
+    parser.add_argument("--max-gap", type=int, default=None,
+                        help="drop rows in runs of more than this many corrupt measurements instead of filling them")
+    parser.add_argument("--period", choices=PERIOD_NAMES, default="minute", help="aggregation period")
+    parser.add_argument("--backend", choices=BACKENDS, default="pandas",
+                        help="run loading, aggregation and statistics with pandas or as a lazy polars query")
+    parser.add_argument("--start", help="only use the measurements from this time on, e.g. 2006-03-01")
+    parser.add_argument("--end", help="only use the measurements before this time")
+    parser.add_argument("--zones", type=int, nargs="+", choices=[1, 2, 3, 4], help="only use these zones")
+    parser.add_argument("--stats", action="store_true", help="print statistics (default if no action is given)")
+    parser.add_argument("--plot", choices=["all", "each"], help="plot the combined zones or each zone")
+    parser.add_argument("--export", metavar="DIR",
+                        help="write the aggregated data and statistics to DIR, and the plot if --plot is given")
+    parser.add_argument("--exact", action="store_true", default=None, help="compute exact quartiles")
+    parser.add_argument("--chunksize", type=int, default=None, help="stream files in chunks of this many rows")
+    parser.add_argument("--cache", action="store_true", help="load through the binary cache")
+    parser.add_argument("--rollups", action="store_true",
+                        help="answer aggregates from hour/day/month rollups stored next to the file")
+    parser.add_argument("--engine", choices=ENGINES, default=None,
+                        help="parse files with a fixed-layout csv reader instead of pd.read_csv")
+    parser.add_argument("--anomalies", action="store_true",
+                        help="find z-score peaks and runs of zero and corrupt measurements per zone. "
+                             "Overlaid on --plot and written by --export")
+    parser.add_argument("--window", type=int, default=None,
+                        help="rows in the rolling window of --anomalies (default 60, an hour of minutes)")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="z-score above which --anomalies reports a peak (default 4)")
+    parser.add_argument("--stages", action="store_true",
+                        help="print the time, rows and rows/sec of each stage (load, clean, aggregate, statistics, plot)")
+    parser.add_argument("--stages-json", metavar="FILE", help="write the stages to a JSON file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the peak memory of each stage with tracemalloc (slower)")
+    parser.add_argument("--profile", metavar="FILE", nargs="?", const="",
+                        help="run under cProfile and print the slowest functions, or write the profile to FILE")
+    args = parser.parse_args(argv)
+
+    if not (args.stats or args.plot or args.export or args.anomalies):
+        args.stats = True
+    return args
+
+
+def main(argv=None):
+    """
+    Run the pipeline on each file given on the command line
+
+    Args:
+        argv (list): the arguments. Default is sys.argv
+    """
+    args = parse_args(argv)
+
+    if args.stages or args.stages_json or args.trace_memory:
+        instrumentation.enable(memory=args.trace_memory)
+    if args.profile is not None:
+        instrumentation.profile(run, args, output=args.profile or None)
+    else:
+        run(args)
+
+    if instrumentation.ENABLED:
+        instrumentation.disable()
+        print("\n{}".format(instrumentation.summary_table()))
+        if args.stages_json:
+            instrumentation.export_json(args.stages_json)
+            print("\nStages recorded in {}".format(args.stages_json))
+
+
+def run(args):
+    """
+    Print statistics for, export and plot each file
+
+    Args:
+        args (argparse.Namespace): the parsed command line
+    """
+    period = PERIOD_NAMES[args.period]
+
+    for filename in args.files:
+        pipeline = Pipeline(filename, FMODES[args.fmode], args.chunksize, args.cache, args.max_gap,
+                            args.engine, args.start, args.end, args.zones,
+                            args.backend, args.rollups)
+        if len(args.files) > 1:
+            print("\n{}".format(filename))
+        if args.stats:
+            print("Corrupt measurements per zone:\n{}".format(pipeline.corruption_counts.to_string()))
+            pipeline.print_statistics(period, args.exact)
+        anomalies = None
+        if args.anomalies:
+            anomalies = pipeline.anomalies(period, args.window, args.threshold)
+            print("\nPeaks and runs per zone (window of {} rows, z-score above {})\n".format(
+                anomalies.window, anomalies.threshold))
+            print(anomalies.summary().to_string())
+        if args.export:
+            for written in pipeline.export(args.export, period):
+                print("Wrote {}".format(written))
+            if anomalies is not None:
+                name = "{}_{}".format(os.path.splitext(os.path.basename(filename))[0], period.replace(" ", "_"))
+                for written in anomalies.export(args.export, name, pipeline.aggregate(period)[3]):
+                    print("Wrote {}".format(written))
+        if args.plot and args.export:
+            # Save the plot next to the exported data instead of showing it
+            name = "{}_{}_{}.png".format(os.path.splitext(os.path.basename(filename))[0],
+                                         period.replace(" ", "_"), args.plot)
+            print("Wrote {}".format(pipeline.plot(args.plot, period, output=os.path.join(args.export, name),
+                                                  anomalies=anomalies)))
+        elif args.plot:
+            pipeline.plot(args.plot, period, anomalies=anomalies)
+
+
+if __name__ == "__main__":
+    main()
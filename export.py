@@ -0,0 +1,148 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batch import FMODES, expand_sources
+from cli import PERIOD_NAMES
+from pipeline import Pipeline
+
+# Pipelines of the files loaded by this worker process, so each file is only loaded once
+PIPELINES = {}
+
+
+class PlotJob:
+    """
+    One figure to render
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        period (Str): the aggregation period
+        zones (str): "all" or "each"
+        output (str): the file to save the figure to
+    """
+
+    def __init__(self, filename, fmode, period, zones, output):
+        self.filename = filename
+        self.fmode = fmode
+        self.period = period
+        self.zones = zones
+        self.output = output
+        self.seconds = 0.0
+        self.error = None
+
+
+def render_job(job):
+    """
+    Render one figure to a file. Runs in a worker process
+
+    Args:
+        job (PlotJob): the figure to render
+    Return:
+        (PlotJob): the job with its render time or error
+    """
+    key = (job.filename, job.fmode)
+    try:
+        if key not in PIPELINES:
+            PIPELINES[key] = Pipeline(job.filename, job.fmode)
+        pipeline = PIPELINES[key]
+        # Load and aggregate before the timer starts, so only the rendering is timed
+        pipeline.aggregate(job.period)
+        start = time.perf_counter()
+        pipeline.plot(job.zones, job.period, output=job.output)
+        job.seconds = time.perf_counter() - start
+    except Exception as e:
+        job.error = "{}: {}".format(type(e).__name__, e)
+    return job
+
+
+def render_file_jobs(jobs):
+    """
+    Render the figures of one file in order. Runs in a worker process, which loads the file once
+    and drops it when its figures are done
+
+    Args:
+        jobs (list): PlotJob objects of the same file and fmode
+    Return:
+        (list): the jobs with their render times or errors
+    """
+    finished = [render_job(job) for job in jobs]
+    PIPELINES.pop((jobs[0].filename, jobs[0].fmode), None)
+    return finished
+
+
+def make_jobs(files, fmode, periods, zones, directory, fmt="png"):
+    """
+    Create a job for every combination of file, period and zones
+
+    Args:
+        files (list): the names of the data files
+        fmode (str): the requested data processing
+        periods (list): the aggregation periods
+        zones (list): "all" and/or "each"
+        directory (str): the output directory
+        fmt (str): the image format, e.g. "png" or "svg"
+    Return:
+        (list): the PlotJob objects
+    """
+    jobs = []
+    for filename in files:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        for period in periods:
+            for zone in zones:
+                output = os.path.join(directory, "{}_{}_{}.{}".format(name, period.replace(" ", "_"), zone, fmt))
+                jobs.append(PlotJob(filename, fmode, period, zone, output))
+    return jobs
+
+
+def render_jobs(jobs, workers=None):
+    """
+    Render figures in parallel worker processes. The jobs of each file are sent to the pool
+    as one task, so the file is loaded once and its figures are rendered by the same worker
+
+    Args:
+        jobs (list): PlotJob objects
+        workers (int): number of worker processes. Default is the number of cores
+    Return:
+        (list): the finished jobs in the order they were given
+    """
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok=True)
+    # Positions of the jobs of each file
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault((job.filename, job.fmode), []).append(i)
+
+    finished = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_file_jobs, [jobs[i] for i in positions]): positions
+                   for positions in groups.values()}
+        for future in as_completed(futures):
+            finished.update(zip(futures[future], future.result()))
+    return [finished[i] for i in range(len(jobs))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render plots of many meter files to image files")
+    parser.add_argument("sources", nargs="+", help="meter files, directories or glob patterns")
+    parser.add_argument("--output", required=True, help="directory to write the images to")
+    parser.add_argument("--fmode", choices=FMODES, default="drop", help="handling of corrupted data")
+    parser.add_argument("--period", choices=PERIOD_NAMES, action="append", help="period to plot (repeatable)")
+    parser.add_argument("--zones", choices=["all", "each"], action="append", help="layout to plot (repeatable)")
+    parser.add_argument("--format", default="png", help="image format, e.g. png or svg")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    periods = [PERIOD_NAMES[period] for period in args.period or ["day"]]
+    jobs = make_jobs(expand_sources(args.sources), FMODES[args.fmode], periods, args.zones or ["all", "each"],
+                     args.output, args.format)
+
+    start = time.perf_counter()
+    for job in render_jobs(jobs, args.workers):
+        print("{:<60} {:>8.3f} s  {}".format(job.output, job.seconds, job.error or "ok"))
+    print("\n{} figures in {:.3f} s".format(len(jobs), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from functions import COLUMNS, TIME_COLUMNS, ZONE_COLUMNS
+
+# Readers selectable with the engine argument of load_measurements
+ENGINES = ["pandas", "numpy", "pyarrow"]
+
+# Number of bytes parsed at a time by the NumPy reader
+BLOCK_SIZE = 8 * 1024 ** 2
+
+
+def count_rows(filename, block_size=BLOCK_SIZE):
+    """
+    Count the rows of a data file without parsing it
+
+    Args:
+        filename (str): the name of the data file
+        block_size (int): number of bytes read at a time
+    Return:
+        (int): the number of non-empty lines
+    """
+    rows = 0
+    last = b"\n"
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            rows += block.count(b"\n")
+            last = block[-1:]
+    # The last line may not end with a newline
+    if last != b"\n":
+        rows += 1
+    return rows
+
+
+def complete_lines(filename, block_size=BLOCK_SIZE):
+    """
+    Find the complete lines of a data file that may still be written to, without parsing it
+
+    Args:
+        filename (str): the name of the data file
+        block_size (int): number of bytes read at a time
+    Return:
+        (tuple): the number of bytes up to the last newline and the number of non-empty lines in them
+    """
+    rows = 0
+    size = 0
+    position = 0
+    last = b"\n"
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            # A line ends at a newline that does not follow another newline
+            text = np.frombuffer(last + block, dtype=np.uint8)
+            rows += int(np.count_nonzero((text[1:] == ord("\n")) & (text[:-1] != ord("\n"))))
+            end = block.rfind(b"\n")
+            if end >= 0:
+                size = position + end + 1
+            position += len(block)
+            last = block[-1:]
+    return (size, rows)
+
+
+def read_numpy(filename, block_size=BLOCK_SIZE, nrows=None):
+    """
+    Parse a meter file into preallocated typed arrays with the C parser of np.loadtxt, one block at a time.
+    Peak memory is the result plus one block, with no per-value Python objects or type inference
+
+    Args:
+        filename (str): the name of the data file
+        block_size (int): number of bytes parsed at a time
+        nrows (int): only parse the first nrows rows
+    Return:
+        (pandas DataFrame object): N x 10 matrix with int16 time columns and float64 zones
+    """
+    # file.read allocates the full block size up front, so small files are read in one smaller block
+    block_size = min(block_size, os.path.getsize(filename) + 1)
+    rows = count_rows(filename, block_size)
+    if nrows is not None:
+        rows = min(rows, nrows)
+    times = np.empty((rows, 6), dtype=np.int16)
+    zones = np.empty((rows, 4), dtype=np.float64)
+
+    position = 0
+    rest = b""
+    with open(filename, "rb") as file:
+        while True:
+            block = file.read(block_size)
+            text = rest + block
+            # Only parse complete lines, the unfinished last line is parsed with the next block
+            end = text.rfind(b"\n") + 1 if block else len(text)
+            text, rest = text[:end], text[end:]
+            if text.strip():
+                values = np.loadtxt(io.BytesIO(text), delimiter=",", dtype=np.float64, ndmin=2)
+                if values.shape[1] != 10:
+                    raise ValueError("{} does not have 10 values in every row".format(filename))
+                values = values[:rows - position]
+                times[position:position + len(values)] = values[:, :6]
+                zones[position:position + len(values)] = values[:, 6:]
+                position += len(values)
+            if not block or position == rows:
+                break
+
+    df = pd.DataFrame(times[:position], columns=TIME_COLUMNS, copy=False)
+    df[ZONE_COLUMNS] = zones[:position]
+    return df
+
+
+def read_pyarrow(filename, size=None):
+    """
+    Parse a meter file with the multi-threaded pyarrow CSV reader and fixed column types
+
+    Args:
+        filename (str): the name of the data file
+        size (int): only parse the bytes before this offset, so an unfinished last line is never read
+    Return:
+        (pandas DataFrame object): N x 10 matrix with int16 time columns and float64 zones
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        raise ImportError("The pyarrow engine requires pyarrow. Install it with: pip install pyarrow")
+
+    types = {column: pa.int16() for column in TIME_COLUMNS}
+    types.update({column: pa.float64() for column in ZONE_COLUMNS})
+    options = {"read_options": pa_csv.ReadOptions(column_names=COLUMNS),
+               "convert_options": pa_csv.ConvertOptions(column_types=types)}
+    if size is None:
+        return pa_csv.read_csv(filename, **options).to_pandas()
+    # The memory map is not copied, the reader only sees the first size bytes of it
+    with pa.memory_map(filename) as source:
+        table = pa_csv.read_csv(pa.BufferReader(source.read_buffer(size)), **options)
+    return table.to_pandas()
+
+
+def read_meter_csv(filename, engine="numpy", lines=None):
+    """
+    Read a meter file in the fixed layout of six integer time fields and four zones
+
+    Args:
+        filename (str): the name of the data file
+        engine (str): "numpy", "pyarrow" or "pandas" (pd.read_csv with fixed names and dtypes)
+        lines (tuple): only read the complete lines of a file that is still being written, as the
+            number of bytes and rows returned by complete_lines
+    Return:
+        (pandas DataFrame object): N x 10 matrix with the columns in COLUMNS
+    """
+    nrows = None if lines is None else lines[1]
+    if engine == "numpy":
+        return read_numpy(filename, nrows=nrows)
+    elif engine == "pyarrow":
+        return read_pyarrow(filename, None if lines is None else lines[0])
+    elif engine == "pandas":
+        dtypes = {column: np.int16 for column in TIME_COLUMNS}
+        return pd.read_csv(filename, header=None, names=COLUMNS, dtype=dtypes, nrows=nrows)
+    raise ValueError("Unknown engine: {}".format(engine))
@@ -1,28 +1,488 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as md
+
+import instrumentation
+from rendering import DOWNSAMPLE_THRESHOLD, plot_line
+from streaming_stats import compute_statistics
+
 pd.options.mode.chained_assignment = None  # chained assingment warning removed
 
+# Column names of the fixed 10-column meter file layout
+TIME_COLUMNS = ['year', 'month', 'day', 'hour', 'minute', 'second']
+ZONE_COLUMNS = ['zone 1', 'zone 2', 'zone 3', 'zone 4']
+COLUMNS = TIME_COLUMNS + ZONE_COLUMNS
+
+# Nanoseconds per time unit, used to group int64 timestamps
+NS_PER_SECOND = 10 ** 9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# Colors of the zones in plots
+ZONE_COLORS = {'zone 1': 'blue', 'zone 2': 'red', 'zone 3': 'magenta', 'zone 4': 'green'}
+
+# Layout of the subplots for plots of 1 to 4 zones
+SUBPLOT_GRIDS = {1: (1, 1), 2: (1, 2), 3: (2, 2), 4: (2, 2)}
+
+# Data processing options handled by impute
+IMPUTE_MODES = ["linear", "zone fill"]
+
+# Measurements are displayed in kWh when any of them is above this many Wh
+KWH_THRESHOLD = 10000
+
+# Number of Wh per display unit
+UNIT_SCALES = {"Wh": 1, "kWh": 1000}
+
+# print_statistics computes exact quartiles up to this many rows
+EXACT_STATISTICS_ROWS = 10_000_000
+
+# Figures reused by visualize when exporting, by (rows, columns) of subplots
+FIGURE_CACHE = {}
+
+# Compact dtypes used when a file is streamed in chunks
+CHUNK_DTYPES = {'year': np.int16, 'month': np.uint8, 'day': np.uint8, 'hour': np.uint8,
+                'minute': np.uint8, 'second': np.uint8, 'zone 1': np.float32,
+                'zone 2': np.float32, 'zone 3': np.float32, 'zone 4': np.float32}
+
+# widen_zones restores at most this many decimals of a float32 measurement
+WIDEN_DECIMALS = 7
+
+# Number of rows converted at a time by widen_zones
+WIDEN_BLOCK_ROWS = 1_000_000
+
+
+def read_last_row(filename, end=None):
+    """
+    Read the last row of a data file without reading the rest of the file
 
-def load_measurements(filename, fmode):
-    """This function loads the data and processes the data based on user requests.
     Args:
         filename (str): the name of the data file
+        end (int): only look at the bytes before this offset. Default is the end of the file
+    Return:
+        (list): the values of the last non-empty row as floats
+    """
+    with open(filename, "rb") as file:
+        file.seek(0, 2)
+        position = file.tell() if end is None else end
+        tail = b""
+        # Read backwards in blocks until a full non-empty line has been found
+        while position > 0 and tail.strip().count(b"\n") == 0:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            tail = file.read(step) + tail
+
+    line = tail.strip().split(b"\n")[-1]
+    return [float(value) for value in line.split(b",")]
+
+
+class ChunkCleaner:
+    """
+    Applies the corruption handling of load_measurements to a file one chunk at a time.
+
+    Forward fill carries the last row across chunk boundaries. Backward fill holds back the
+    rows after the last fully valid row of a chunk until the next valid value arrives.
+
+    Args:
         fmode (str): the requested data processing
+        last_row_corrupt (bool): whether the last row of the file is corrupt (needed by backward fill)
+    """
+
+    def __init__(self, fmode, last_row_corrupt=False):
+        self.fmode = fmode
+        self.first_chunk = True
+        # Last output row (forward fill) or rows waiting for a valid value (backward fill)
+        self.carry = None
+        # Number of corrupt measurements seen in each zone
+        self.counts = pd.Series(0, index=ZONE_COLUMNS)
+
+        # Drop all corrupt rows if there is a NaN value in the last row
+        if fmode == "backward fill" and last_row_corrupt:
+            self.fmode = "drop"
+            print("Warning! There is an invalid measurement in the last row of the file. " +
+                  "All corrupt measurements have been dropped.")
+
+    def feed(self, chunk):
+        """
+        Clean the next chunk of the file
+
+        Args:
+            chunk (pandas DataFrame object): the next rows of the file with -1 replaced by NaN
+        Return:
+            (pandas DataFrame object): the rows that are final after this chunk
+        """
+        self.counts += chunk[ZONE_COLUMNS].isnull().sum()
+
+        # Drop all corrupt rows if there is a NaN value in the first row
+        if self.first_chunk and self.fmode == "forward fill" and len(chunk) > 0:
+            if chunk.iloc[0].isnull().values.any():
+                self.fmode = "drop"
+                print("Warning! There is an invalid measurement in the first row of the file. " +
+                      "All corrupt measurements have been dropped.")
+        if len(chunk) > 0:
+            self.first_chunk = False
+
+        if self.fmode == "forward fill":
+            # Prepend the last row of the previous chunk so the fill continues across the boundary
+            if self.carry is not None:
+                chunk = pd.concat([self.carry, chunk]).ffill(axis=0).iloc[1:]
+            else:
+                chunk = chunk.ffill(axis=0)
+            if len(chunk) > 0:
+                self.carry = chunk.iloc[[-1]]
+            return chunk
+
+        elif self.fmode == "backward fill":
+            if self.carry is not None:
+                chunk = pd.concat([self.carry, chunk])
+            # Rows up to the last fully valid row can be filled now, the rest has to wait
+            valid = np.flatnonzero(~chunk.isnull().values.any(axis=1))
+            if len(valid) == 0:
+                self.carry = chunk
+                return chunk.iloc[:0]
+            self.carry = chunk.iloc[valid[-1] + 1:]
+            return chunk.iloc[:valid[-1] + 1].bfill(axis=0)
+
+        elif self.fmode == "drop":
+            return chunk.dropna()
+
+        return chunk
+
+    def finish(self):
+        """
+        Flush the rows held back at the end of the file
+
+        Return:
+            (pandas DataFrame object): the remaining cleaned rows, or None if there are none
+        """
+        carry, self.carry = self.carry, None
+        if self.fmode != "backward fill" or carry is None:
+            return None
+        # Rows without a later valid value can not be filled and are dropped
+        return carry.bfill(axis=0).dropna()
+
+
+def mask_corrupt(chunk):
+    """
+    Replace all -1 values of a chunk read with CHUNK_DTYPES with NaN, in place
+
+    Args:
+        chunk (pandas DataFrame object): M x 10 matrix
     Return:
-        (tuple): a tuple containing 2 panda DataFrames: tvec (N x 6 matrix), data (N x 4 matrix)
+        (pandas DataFrame object): the chunk
     """
+    # Only the zones can hold -1 with these dtypes
+    zones = chunk[ZONE_COLUMNS].to_numpy()
+    zones[zones == -1] = np.nan
+    chunk[ZONE_COLUMNS] = zones
+    return chunk
 
-    # Load the data into a pandas DataFrame
-    df = pd.read_csv(filename,header=None)
 
-    df = df.rename(columns={0:'year',1:'month',2:'day',3:'hour',4:'minute',5:'second',6:'zone 1',7:'zone 2',8:'zone 3',9:'zone 4'})
+def widen_zones(data):
+    """
+    Convert float32 measurements back to float64 at the precision of the file. Each value becomes the
+    shortest decimal that reads as the same float32, so 17.3 is printed and exported as 17.3 and not
+    as 17.299999 (17.299999237 when only upcast)
+
+    Args:
+        data (pandas DataFrame object): N x 4 matrix with float32 zones, after cleaning
+    Return:
+        (pandas DataFrame object): the N x 4 matrix with float64 zones. Other dtypes are returned unchanged
+    """
+    if not (data.dtypes == np.float32).all() or data.shape[1] == 0:
+        return data
+    narrow = data.to_numpy()
+    wide = narrow.astype(np.float64)
+    for start in range(0, len(wide), WIDEN_BLOCK_ROWS):
+        block = wide[start:start + WIDEN_BLOCK_ROWS].ravel()
+        original = narrow[start:start + WIDEN_BLOCK_ROWS].ravel()
+        # Values that are not yet a decimal with few enough digits, NaN is kept
+        pending = np.flatnonzero(~np.isnan(block))
+        for decimals in range(WIDEN_DECIMALS + 1):
+            rounded = np.round(block[pending], decimals)
+            exact = rounded.astype(np.float32) == original[pending]
+            block[pending[exact]] = rounded[exact]
+            pending = pending[~exact]
+            if len(pending) == 0:
+                break
+        wide[start:start + WIDEN_BLOCK_ROWS] = block.reshape(-1, wide.shape[1])
+    return pd.DataFrame(wide, index=data.index, columns=data.columns)
+
+
+def load_chunked(filename, fmode, chunksize, lines=None):
+    """
+    Stream a data file in fixed-size chunks with compact dtypes and clean each chunk.
+    The result has the same values as the in-memory path of load_measurements.
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing. Other values than "forward fill",
+            "backward fill" and "drop" leave the corrupt measurements as NaN
+        chunksize (int): number of rows read at a time
+        lines (tuple): only read the complete lines of a file that is still being written, as the
+            number of bytes and rows returned by fast_csv.complete_lines
+    Return:
+        (tuple): N x 10 matrix with the cleaned rows and the number of corrupt measurements per zone
+    """
+    size, nrows = (None, None) if lines is None else lines
+    last_row_corrupt = fmode == "backward fill" and -1 in read_last_row(filename, size)
+    cleaner = ChunkCleaner(fmode, last_row_corrupt)
+
+    cleaned = []
+    reader = pd.read_csv(filename, header=None, names=COLUMNS, dtype=CHUNK_DTYPES, chunksize=chunksize,
+                         nrows=nrows)
+    for chunk in reader:
+        cleaned.append(cleaner.feed(mask_corrupt(chunk)))
+    rest = cleaner.finish()
+    if rest is not None:
+        cleaned.append(rest)
+
+    return (pd.concat(cleaned), cleaner.counts)
+
+
+def gap_lengths(mask):
+    """
+    Compute the length of the run of missing values that each missing value belongs to
+
+    Args:
+        mask (numpy array): N x M boolean matrix, True where a value is missing
+    Return:
+        (numpy array): N x M matrix with the run length at missing values and 0 elsewhere
+    """
+    n, m = mask.shape
+    # Pad every column with a valid value and flatten column by column, so runs never cross columns
+    padded = np.vstack([mask, np.zeros((1, m), dtype=bool)]).T.ravel()
+    # Every valid value starts a new run id, the missing values after it share that id
+    run_id = np.cumsum(~padded)
+    lengths = np.bincount(run_id, weights=padded).astype(np.int64)
+    result = np.where(padded, lengths[run_id], 0)
+    return result.reshape(m, n + 1)[:, :n].T
+
+
+def fill_forward(values, mask):
+    """Replace missing values in each column by the last valid value above them (NaN if there is none)"""
+    rows = np.where(mask, 0, np.arange(len(values))[:, None])
+    # Leading missing values point at row 0, which is only valid if it is not missing itself
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    filled = np.take_along_axis(values, rows, axis=0)
+    filled[np.cumsum(~mask, axis=0) == 0] = np.nan
+    return filled
+
+
+def fill_backward(values, mask):
+    """Replace missing values in each column by the next valid value below them (NaN if there is none)"""
+    return fill_forward(values[::-1], mask[::-1])[::-1]
+
+
+def impute(df, fmode, max_gap=None):
+    """
+    Fill the corrupt measurements of each zone independently with whole-array NumPy operations
+
+    Unlike the forward and backward fill of load_measurements, a corrupt first or last row does
+    not drop every corrupt measurement in the file. Only rows that can not be filled are dropped.
+
+    Args:
+        df (pandas DataFrame object): N x 10 matrix with NaN for corrupt measurements. A subset of
+            the zone columns is also accepted
+        fmode (str): "linear" (interpolate in time), "zone fill" (forward fill, then backward fill
+            at the start of the file), "forward fill", "backward fill" or "drop"
+        max_gap (int): rows in a run of more than max_gap corrupt measurements are dropped instead of filled
+    Return:
+        (tuple): the cleaned N x 10 matrix and the number of corrupt measurements per zone
+    """
+    zone_columns = [column for column in df.columns if column in ZONE_COLUMNS]
+    zones = df[zone_columns].to_numpy(np.float64)
+    mask = np.isnan(zones)
+    counts = pd.Series(mask.sum(axis=0), index=zone_columns)
+
+    if fmode == "linear":
+        # Interpolate between the valid measurements around each gap, using the time of each row.
+        # np.interp repeats the first and last valid measurement at the edges of the file
+        times = time_index(df[TIME_COLUMNS]).to_numpy("datetime64[ns]").view(np.int64).astype(np.float64)
+        filled = zones.copy()
+        for i in range(zones.shape[1]):
+            valid = ~mask[:, i]
+            if valid.any():
+                filled[mask[:, i], i] = np.interp(times[mask[:, i]], times[valid], zones[valid, i])
+    elif fmode == "zone fill":
+        filled = fill_forward(zones, mask)
+        # Corrupt measurements at the start of a zone take the first valid measurement
+        filled = np.where(np.isnan(filled), fill_backward(zones, mask), filled)
+    elif fmode == "forward fill":
+        filled = fill_forward(zones, mask)
+    elif fmode == "backward fill":
+        filled = fill_backward(zones, mask)
+    elif fmode == "drop":
+        filled = zones
+    else:
+        raise ValueError("Unknown fmode: {}".format(fmode))
+
+    # Measurements in gaps that are too long are not filled, so their rows are dropped
+    if max_gap is not None:
+        filled[gap_lengths(mask) > max_gap] = np.nan
+
+    keep = ~np.isnan(filled).any(axis=1)
+    df = df.copy()
+    df[zone_columns] = filled
+    return (df[keep], counts)
+
+
+class ImputeCleaner:
+    """
+    Applies impute to rows that arrive a few at a time, like the rows appended to Measurements.
+
+    Each zone continues from its last valid measurement. A corrupt measurement that needs a later
+    valid measurement (linear and backward fill, and every gap if max_gap is given) holds back its row
+    and the rows after it until that measurement arrives, so the rows get the same values as in a
+    reload of the whole file. Same interface as ChunkCleaner.
+
+    Args:
+        fmode (str): the requested data processing (see impute)
+        max_gap (int): rows in a run of more than max_gap corrupt measurements are dropped instead of filled
+    """
+
+    def __init__(self, fmode, max_gap=None):
+        if fmode not in IMPUTE_MODES + ["forward fill", "backward fill", "drop"]:
+            raise ValueError("Unknown fmode: {}".format(fmode))
+        self.fmode = fmode
+        self.max_gap = max_gap
+        # Rows waiting for a later valid measurement
+        self.carry = None
+        # Number of corrupt measurements seen in each zone
+        self.counts = pd.Series(0, index=ZONE_COLUMNS)
+        # Last valid measurement of each zone, the time of its row in nanoseconds, and the number of
+        # corrupt measurements after it
+        self.last_value = np.full(len(ZONE_COLUMNS), np.nan)
+        self.last_time = np.full(len(ZONE_COLUMNS), np.nan)
+        self.run = np.zeros(len(ZONE_COLUMNS), dtype=np.int64)
+
+    def seed(self, timestamp, values):
+        """
+        Continue from a row of cleaned measurements
+
+        Args:
+            timestamp (pandas Timestamp object): the time of the row
+            values (pandas Series object): the measurements of the row
+        """
+        self.last_value = np.asarray(values, dtype=np.float64).copy()
+        self.last_time = np.full(len(ZONE_COLUMNS), float(timestamp.value))
+        self.run[:] = 0
+
+    def feed(self, chunk):
+        """
+        Clean the next rows
+
+        Args:
+            chunk (pandas DataFrame object): the next rows in the 10-column layout with NaN for corrupt measurements
+        Return:
+            (pandas DataFrame object): the rows that are final after this chunk
+        """
+        self.counts += chunk[ZONE_COLUMNS].isnull().sum()
+        if self.carry is not None:
+            chunk = pd.concat([self.carry, chunk])
+        zones = chunk[ZONE_COLUMNS].to_numpy(np.float64)
+        mask = np.isnan(zones)
+        times = time_index(chunk[TIME_COLUMNS]).asi8.astype(np.float64)
+        seeded = ~np.isnan(self.last_value)
+
+        seen = np.cumsum(~mask, axis=0) > 0
+        # Valid measurements at or after each row
+        later = np.logical_or.accumulate(~mask[::-1], axis=0)[::-1]
+        open_gap = mask & ~later
+        # The run a zone ended in before this chunk continues at its start
+        lengths = np.where(seen, 0, self.run) + gap_lengths(mask)
+        too_long = mask & (lengths > self.max_gap) if self.max_gap is not None else np.zeros_like(mask)
+
+        if self.fmode in ["linear", "backward fill"]:
+            waiting = open_gap
+        elif self.fmode == "zone fill":
+            waiting = open_gap & ~(seen | seeded)
+        else:
+            waiting = np.zeros_like(mask)
+        # The length of an open gap is only known when it ends
+        if self.max_gap is not None and self.fmode != "drop":
+            waiting = (waiting | open_gap) & ~too_long
+        waiting_rows = np.flatnonzero(waiting.any(axis=1))
+        end = waiting_rows[0] if len(waiting_rows) > 0 else len(chunk)
+
+        if self.fmode == "linear":
+            filled = zones.copy()
+            for i in range(zones.shape[1]):
+                valid = ~mask[:, i]
+                points = np.concatenate([self.last_time[i:i + 1][seeded[i:i + 1]], times[valid]])
+                values = np.concatenate([self.last_value[i:i + 1][seeded[i:i + 1]], zones[valid, i]])
+                if len(points) > 0:
+                    filled[mask[:, i], i] = np.interp(times[mask[:, i]], points, values)
+        elif self.fmode in ["zone fill", "forward fill"]:
+            # The last valid measurements lead the chunk, so the fill continues from them
+            filled = fill_forward(np.vstack([self.last_value, zones]), np.vstack([~seeded, mask]))[1:]
+            if self.fmode == "zone fill":
+                filled = np.where(np.isnan(filled), fill_backward(zones, mask), filled)
+        elif self.fmode == "backward fill":
+            filled = fill_backward(zones, mask)
+        else:
+            filled = zones
+        filled = np.where(too_long, np.nan, filled)
+
+        if end > 0:
+            final = ~mask[:end]
+            last = end - 1 - np.argmax(final[::-1], axis=0)
+            found = final.any(axis=0)
+            columns = np.arange(zones.shape[1])
+            self.last_value = np.where(found, zones[last, columns], self.last_value)
+            self.last_time = np.where(found, times[last], self.last_time)
+            self.run = np.where(found, end - 1 - last, self.run + end)
+        self.carry = chunk.iloc[end:] if end < len(chunk) else None
+
+        done = chunk.iloc[:end].copy()
+        done[ZONE_COLUMNS] = filled[:end]
+        return done[~np.isnan(filled[:end]).any(axis=1)]
+
+
+def clean_measurements(df, fmode, max_gap=None):
+    """
+    Process the corrupt measurements of a loaded data file based on user requests
+
+    Args:
+        df (pandas DataFrame object): N x 10 matrix with -1 for corrupt measurements. A subset of
+            the zone columns is also accepted
+        fmode (str): the requested data processing (see load_measurements)
+        max_gap (int): fill each zone independently with impute and drop the rows in runs of
+            more than max_gap corrupt measurements
+    Return:
+        (tuple): the cleaned matrix and the number of corrupt measurements per zone
+    """
     # Replace all -1 values with NaN
-    df = df.replace(to_replace=-1, value=np.nan)
+    with instrumentation.stage("replace", len(df)):
+        df = df.replace(to_replace=-1, value=np.nan)
+        counts = df.iloc[:, 6:].isnull().sum()
+
+    with instrumentation.stage("fill ({})".format(fmode), len(df)):
+        df, counts = fill_measurements(df, counts, fmode, max_gap)
+
+    return (df, counts)
+
+
+def fill_measurements(df, counts, fmode, max_gap=None):
+    """
+    Fill or drop the corrupt measurements (NaN) of a loaded data file. Used by clean_measurements
+
+    Args:
+        df (pandas DataFrame object): N x 10 matrix with NaN for corrupt measurements
+        counts (pandas Series object): number of corrupt measurements per zone
+        fmode (str): the requested data processing (see load_measurements)
+        max_gap (int): the gap limit of load_measurements
+    Return:
+        (tuple): the cleaned matrix and the number of corrupt measurements per zone
+    """
+    use_impute = fmode in IMPUTE_MODES or max_gap is not None
+
+    # Fill each zone independently
+    if use_impute:
+        df, counts = impute(df, fmode, max_gap)
 
     # Process the data based on the users request
-    if fmode == "forward fill":
+    elif fmode == "forward fill":
         # Drop all corrupt rows if there is a NaN value in the first row
         if df.iloc[0].isnull().values.any():
             df = df.dropna()
@@ -47,81 +507,373 @@ def load_measurements(filename, fmode):
         # Drop all rows with corrupted measurements
         df = df.dropna()
 
+    return (df, counts)
+
+
+def measurement_key(fmode, max_gap=None, chunksize=None, engine=None, complete_lines=False):
+    """
+    Get the part of the cache key of load_measurements that depends on its arguments
+
+    Args:
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit
+        chunksize (int): the chunk size of the chunked loader
+        engine (str): the csv reader of fast_csv
+        complete_lines (bool): only the complete lines of the file are loaded
+    Return:
+        (str): the key
+    """
+    # The gap limit changes the result, and the chunked loader and the engines change the
+    # dtypes, so they are part of the cache key
+    key = fmode if max_gap is None else "{}|{}".format(fmode, max_gap)
+    if chunksize:
+        key = "{}|chunks {}".format(key, chunksize)
+    if engine is not None:
+        key = "{}|engine {}".format(key, engine)
+    # The file is only read up to the last complete line, which is stored with the entry
+    if complete_lines:
+        key = "{}|complete lines".format(key)
+    return key
+
+
+@instrumentation.instrument("load_measurements", rows=lambda arguments, result: len(result[1]))
+def load_measurements(filename, fmode, chunksize=None, cache=False, cache_dir=None, max_gap=None,
+                      return_counts=False, engine=None, lines=None):
+    """This function loads the data and processes the data based on user requests.
+    Args:
+        filename (str): the name of the data file, a csv file or a binary archive (see archive.py)
+        fmode (str): the requested data processing: "forward fill", "backward fill", "drop",
+            "linear" or "zone fill" (see impute)
+        chunksize (int): if given, the file is streamed in chunks of this many rows with
+            compact dtypes (int16/uint8 time and float32 zones) to limit peak memory. The zones
+            are returned as float64 at the precision of the file (see widen_zones)
+        cache (bool): if True, the cleaned data is stored as memory-mapped .npy arrays and
+            reused by later loads until the file changes
+        cache_dir (str): directory of the cache. Default is a .meter_cache directory next to the file
+        max_gap (int): if given, each zone is filled independently with impute and rows in runs of
+            more than max_gap corrupt measurements are dropped
+        return_counts (bool): also return the number of corrupt measurements per zone
+        engine (str): parse the file with the specialised reader of fast_csv ("numpy", "pyarrow" or
+            "pandas") instead of pd.read_csv with type inference
+        lines (tuple): only load the complete lines of a csv file that is still being written, as the
+            number of bytes and rows returned by fast_csv.complete_lines
+    Return:
+        (tuple): a tuple containing 2 panda DataFrames: tvec (N x 6 matrix), data (N x 4 matrix),
+            followed by a Series with the corrupt measurements per zone if return_counts is True
+    """
+
+    if cache:
+        import cache as measurement_cache
+
+        key = measurement_key(fmode, max_gap, chunksize, engine, lines is not None)
+        # Reuse the cleaned data if the file has not changed since it was cached
+        cached = measurement_cache.read_cache(filename, key, (TIME_COLUMNS, ZONE_COLUMNS), cache_dir)
+        if cached is None:
+            cached = load_measurements(filename, fmode, chunksize, max_gap=max_gap, return_counts=True,
+                                       engine=engine, lines=lines)
+            measurement_cache.write_cache(filename, key, *cached, cache_dir=cache_dir, lines=lines)
+        return cached if return_counts else cached[:2]
+
+    from archive import MeterArchive, is_archive
+
+    use_impute = fmode in IMPUTE_MODES or max_gap is not None
+    # Archives are memory-mapped, so they are never streamed
+    binary = is_archive(filename)
+
+    # Stream large files chunk by chunk
+    if chunksize and not binary:
+        with instrumentation.stage("parse and clean chunks"):
+            df, counts = load_chunked(filename, None if use_impute else fmode, chunksize, lines)
+        if use_impute:
+            with instrumentation.stage("impute", len(df)):
+                df, counts = impute(df, fmode, max_gap)
+        data = widen_zones(df[ZONE_COLUMNS])
+        if return_counts:
+            return (df[TIME_COLUMNS], data, counts)
+        return (df[TIME_COLUMNS], data)
+
+    # Load the data into a pandas DataFrame
+    with instrumentation.stage("parse") as record:
+        if binary:
+            df = MeterArchive(filename).frame()
+        elif engine is not None:
+            from fast_csv import read_meter_csv
+
+            df = read_meter_csv(filename, engine, lines)
+        else:
+            df = pd.read_csv(filename,header=None,nrows=lines[1] if lines else None)
+
+            df = df.rename(columns={0:'year',1:'month',2:'day',3:'hour',4:'minute',5:'second',6:'zone 1',7:'zone 2',8:'zone 3',9:'zone 4'})
+        if record is not None:
+            record["rows"] = len(df)
+    df, counts = clean_measurements(df, fmode, max_gap)
+
     # Split the DataFrame into a N x 6 time-matrix and a N x 4 data-matrix
-    tvec = df.iloc[:,:-4]
-    data = df.iloc[:,-4:]
+    tvec = df.iloc[:,:6]
+    data = df.iloc[:,6:]
+    if binary:
+        # Archives store float32 measurements
+        data = widen_zones(data)
 
+    if return_counts:
+        return (tvec, data, counts)
     return (tvec, data)
 
+def zone_columns(zones=None):
+    """
+    Get the column names of a selection of zones
+
+    Args:
+        zones (list): zone numbers (1 to 4) or column names. None or "all" selects every zone
+    Return:
+        (list): the column names in the order of the file
+    """
+    if zones is None or zones == "all":
+        return list(ZONE_COLUMNS)
+    selected = set()
+    for zone in zones:
+        column = zone if zone in ZONE_COLUMNS else "zone {}".format(zone)
+        if column not in ZONE_COLUMNS:
+            raise ValueError("Unknown zone: {}".format(zone))
+        selected.add(column)
+    return [column for column in ZONE_COLUMNS if column in selected]
+
+def time_index(tvec):
+    """
+    Convert the N x 6 time matrix into one datetime64 timestamp per row
+
+    Args:
+        tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector
+    Return:
+        (pandas DatetimeIndex object): N timestamps
+    """
+    # A DatetimeIndex is already in the right representation
+    if isinstance(tvec, (pd.DatetimeIndex, pd.Series)):
+        return pd.DatetimeIndex(tvec)
+
+    values = tvec.to_numpy(np.int64)
+    # Build the timestamps with integer arithmetic instead of parsing every row
+    months = ((values[:, 0] - 1970) * 12 + values[:, 1] - 1).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + (values[:, 2] - 1)
+    ns = days.astype("datetime64[ns]").view(np.int64)
+    ns = ns + values[:, 3] * NS_PER_HOUR + values[:, 4] * NS_PER_MINUTE + values[:, 5] * NS_PER_SECOND
+    return pd.DatetimeIndex(ns.view("datetime64[ns]"))
+
+
+def time_matrix(timestamps, index=None):
+    """
+    Build the N x 6 time matrix view of a set of timestamps
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        index (pandas Index object): index of the returned DataFrame. Default 0 to N-1
+    Return:
+        (pandas DataFrame object): N x 6 matrix. Each row is a time vector
+    """
+    timestamps = pd.DatetimeIndex(timestamps)
+    return pd.DataFrame({column: getattr(timestamps, column).to_numpy(np.int64) for column in TIME_COLUMNS},
+                        index=index)
+
+
+def period_keys(timestamps, period):
+    """
+    Compute the integer group key of every timestamp for an aggregation period
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        period (Str): "hour", "day", "month" or "hour of the day"
+    Return:
+        (numpy array): N int64 keys. Hours, days and months since 1970, or the hour of the day
+    """
+    ns = timestamps.to_numpy("datetime64[ns]").view(np.int64)
+    if period == "hour":
+        return ns // NS_PER_HOUR
+    elif period == "day":
+        return ns // NS_PER_DAY
+    elif period == "month":
+        return timestamps.to_numpy("datetime64[ns]").astype("datetime64[M]").view(np.int64)
+    elif period == "hour of the day":
+        return (ns // NS_PER_HOUR) % 24
+    raise ValueError("Unknown aggregation period: {}".format(period))
+
+
+def period_start(keys, period):
+    """
+    Convert group keys back into the timestamp at the start of each period
+
+    Args:
+        keys (numpy array): int64 keys as returned by period_keys (not "hour of the day")
+        period (Str): "hour", "day" or "month"
+    Return:
+        (pandas DatetimeIndex object): the start of each period
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    if period == "hour":
+        return pd.DatetimeIndex((keys * NS_PER_HOUR).view("datetime64[ns]"))
+    elif period == "day":
+        return pd.DatetimeIndex((keys * NS_PER_DAY).view("datetime64[ns]"))
+    elif period == "month":
+        return pd.DatetimeIndex(keys.view("datetime64[M]").astype("datetime64[ns]"))
+    raise ValueError("Unknown aggregation period: {}".format(period))
+
+
+@instrumentation.instrument("aggregate_measurements", rows=lambda arguments, result: len(arguments["data"]))
 def aggregate_measurements(tvec, data, period):
     """
     This aggregates the data
 
     Args:
-        tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector
+        tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector.
+            A DatetimeIndex with one timestamp per row is also accepted
         data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
         period (Str): How to aggregate the data. By "hour", "day", "month" og "hour of the day"
     Return:
-        tuple: Two panda DataFrame objects - tvec (N x 6 matrix) and data (N x 4 matrix) aggregated according to period
+        tuple: Two panda DataFrame objects - tvec (N x 6 matrix) and data (N x 4 matrix) aggregated according to period.
+            tvec is returned as a DatetimeIndex if it was given as one
     """
-    # Concatenate tvec and data
-    df = pd.concat([tvec,data],axis=1)
+    timestamps = time_index(tvec)
+    # Group on a single integer key per row instead of several time columns
+    keys = period_keys(timestamps, period)
+
+    if period == "hour of the day":
+        data_a = data.groupby(keys).mean()
+        data_a.index.name = "hour"
+
+        # Use the first measurement of each hour, with the time set to the beginning of the hour
+        first = pd.Series(timestamps.to_numpy()).groupby(keys).first()
+        starts = pd.DatetimeIndex(first.to_numpy()).floor("h")
+    else:
+        agg = data.groupby(keys).sum()
+        data_a = agg.reset_index(drop=True)
+
+        # Time is set to the beginning of the hour, day or month
+        starts = period_start(agg.index.to_numpy(), period)
 
-    # Group by year, month, day and hour and aggregate the zones
-    if period == 'hour':
-        agg = df.groupby(['year', 'month', 'day', 'hour']).agg({'zone 1': 'sum', 'zone 2': 'sum','zone 3': 'sum','zone 4': 'sum'})
-        data_a = agg.reset_index().iloc[:,-4:]
-        tvec_a = tvec.drop_duplicates(subset = ['year', 'month', 'day', 'hour'])
+    if isinstance(tvec, pd.DataFrame):
+        tvec_a = time_matrix(starts)
+    else:
+        tvec_a = starts
 
-        # Replace columns with 0 to make sure time starts at the beginning of the hour
-        tvec_a.loc[:,["minute", "second"]] = 0
+    return (tvec_a, data_a)
 
-    elif period == 'day':
-        agg = df.groupby(['year', 'month', 'day']).agg({'zone 1': 'sum', 'zone 2': 'sum','zone 3': 'sum','zone 4': 'sum'})
-        data_a = agg.reset_index().iloc[:,-4:]
-        tvec_a = tvec.drop_duplicates(subset = ['year', 'month', 'day'])
+def display_unit(maxima):
+    """
+    Choose the unit to display measurements in. The data stays in Wh, only the
+    statistics table and the plot axis are scaled when they are output
 
-        # Replace columns with 0 to make sure time starts at the beginning of the day
-        tvec_a.loc[:,["hour", "minute", "second"]] = 0
+    Args:
+        maxima (pandas Series object): the maximum of each zone in Wh
+    Return:
+        (tuple): the unit, "Wh" or "kWh", and its number of Wh
+    """
+    # NaN (a zone without measurements) is never above the threshold
+    if (np.asarray(maxima, dtype=np.float64) > KWH_THRESHOLD).any():
+        return ("kWh", UNIT_SCALES["kWh"])
+    return ("Wh", UNIT_SCALES["Wh"])
 
-    elif period == 'month':
-        agg = df.groupby(['year', 'month']).agg({'zone 1': 'sum', 'zone 2': 'sum','zone 3': 'sum','zone 4': 'sum'})
-        data_a = agg.reset_index().iloc[:,-4:]
-        tvec_a = tvec.drop_duplicates(subset = ['year', 'month'])
 
-        # Replace columns with 0 to make sure time starts at the beginning of the month
-        tvec_a.loc[:,["hour", "minute", "second"]] = 0
+def scale_statistics(table, scale):
+    """
+    Convert a statistics table from Wh into a display unit
 
-    elif period == "hour of the day":
-        data_a = df.groupby('hour').agg({'zone 1': 'mean', 'zone 2': 'mean', 'zone 3': 'mean', 'zone 4': 'mean'})
-        tvec_a = tvec.drop_duplicates(subset = ['hour'])
+    Args:
+        table (pandas DataFrame object): one row per zone with the columns of DataFrame.describe
+        scale (int): number of Wh per display unit (see display_unit)
+    Return:
+        (pandas DataFrame object): the table with every column but the count divided by scale
+    """
+    if scale == 1:
+        return table
+    table = table.copy()
+    table.iloc[:, 1:] /= scale
+    return table
 
-        # Replace columns with 0 to make sure time starts at the beginning of the hour
-        tvec_a.loc[:,["minute", "second"]] = 0
 
-    return (tvec_a, data_a)
+def set_unit_axis(ax, unit, scale=1):
+    """
+    Label the y axis of a plot of measurements in Wh with a display unit. The ticks are divided
+    by scale when they are drawn, so the plotted data is not copied
 
-def print_statistics(tvec, data):
+    Args:
+        ax (matplotlib Axes object): the plot
+        unit (str): the display unit
+        scale (int): number of Wh per display unit
+    """
+    ax.set_ylabel(unit)
+    if scale != 1:
+        from matplotlib.ticker import FuncFormatter
+
+        ax.yaxis.set_major_formatter(FuncFormatter(lambda value, position: "{:g}".format(value / scale)))
+
+
+@instrumentation.instrument("print_statistics", rows=lambda arguments, result: len(arguments["data"]))
+def print_statistics(tvec, data, exact=None, error=0.01, scale=1):
     """
     Print statistics to screen
 
     Args:
         tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector
         data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        exact (bool): compute exact quartiles. Default is exact for up to EXACT_STATISTICS_ROWS rows
+            and estimated with a quantile sketch above that
+        error (float): target rank error of the estimated quartiles
+        scale (int): number of Wh per display unit of the printed table (see display_unit)
+    """
+    if exact is None:
+        exact = len(data) <= EXACT_STATISTICS_ROWS
+    # Compute the statistics of each zone and of all zones combined in one streaming pass,
+    # without adding a column to data
+    with instrumentation.stage("compute_statistics", len(data)):
+        statistics = compute_statistics(data, exact, error)
+    print(format_statistics(scale_statistics(statistics.table(), scale)))
+
+
+def format_statistics(table):
     """
-    # Create a collum with data from all 4 zones
-    data["All"] = data.sum(axis=1)
-    # Use the built-in statistics function in Pandas and slice off the first irrelevant rows.
-    # Transpose the table to match the required layout.
-    table = data.describe().iloc[3:].T
+    Format a statistics table for printing
+
+    Args:
+        table (pandas DataFrame object): one row per zone with the columns of DataFrame.describe
+    Return:
+        (pandas DataFrame object): the minimum, quartiles and maximum of each zone
+    """
+    # Slice off the count, mean and std columns
+    table = table.iloc[:, 3:]
     # Rename the columns according to requirements
-    table = table.rename(columns={"index":"Zone", "minute":"Minimum", "25%":" 1. quart.",
-                          "50%":" 2. quart.", "75%":" 3. quart.", "max":"Maximum"},
-                         index={'zone 1':'1','zone 2':'2','zone 3':'3','zone 4':'4'})
-    print(table)
+    return table.rename(columns={"index":"Zone", "minute":"Minimum", "25%":" 1. quart.",
+                                 "50%":" 2. quart.", "75%":" 3. quart.", "max":"Maximum"},
+                        index={'zone 1':'1','zone 2':'2','zone 3':'3','zone 4':'4'})
 
 
-def visualize(data, tvec, zones, unit, agg_by="minute"):
+def make_subplots(nrows, ncols, reuse=False):
+    """
+    Create a figure with a grid of subplots
+
+    Args:
+        nrows (int): number of rows of subplots
+        ncols (int): number of columns of subplots
+        reuse (bool): reuse a cached figure with the same layout, without pyplot or a display.
+            Used when plots are exported to files
+    Return:
+        (tuple): the figure and its axes
+    """
+    if not reuse:
+        import matplotlib.pyplot as plt
+
+        return plt.subplots(nrows, ncols, figsize=(10, 5))
+
+    from matplotlib.figure import Figure
+
+    if (nrows, ncols) not in FIGURE_CACHE:
+        FIGURE_CACHE[(nrows, ncols)] = Figure(figsize=(10, 5))
+    fig = FIGURE_CACHE[(nrows, ncols)]
+    # Clear the figure from the previous export
+    fig.clf()
+    return (fig, fig.subplots(nrows, ncols))
+
+
+@instrumentation.instrument("visualize", rows=lambda arguments, result: len(arguments["data"]))
+def visualize(data, tvec, zones, unit, agg_by="minute", downsample=None, output=None, scale=1, anomalies=None):
 
     """
         plot the consumption in each zone or the combined consumption (all zones).
@@ -131,32 +883,54 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
 
         Args:
             data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
-            zones (str): Desired zones to plots
+            tvec (pandas DataFrame object): N x 6 matrix or DatetimeIndex. The time of each measurement
+            zones (str or list): "all" for the combined zones, "each" for one plot per zone of data, or a
+                list of zones (numbers or column names) to plot one by one
             unit (str): Unit to display on plot y axis
             agg_by (str): The aggregation period for the data. Default False
+            downsample (bool): Plot lines as a min/max envelope at pixel width that is updated on zoom.
+                Default is to do so for more than rendering.DOWNSAMPLE_THRESHOLD measurements
+            output (str): File to save the plot to (e.g. .png or .svg) instead of showing it. Rendered
+                without a display, reusing the figure of the previous export with the same layout
+            scale (int): Number of Wh per unit. The data is in Wh and the y axis ticks are divided by scale
+            anomalies (anomalies.Anomalies): Rolling mean, peaks and runs of data to overlay on line plots
+        Return:
+            (str): the output file, or None if the plot was shown
     """
 
-    # If aggregated by "hour of the day" dates contains from 0 to 23 hours
+    # matplotlib is only imported when plotting, so headless runs start fast
+    import matplotlib.dates as md
+
+    # If aggregated by "hour of the day" dates contains the hours with data, indexing the rows of data
     if agg_by == "hour of the day":
-        # dates = np.arange(0,24,1)
-        dates = pd.Series(np.arange(0,24,1))
+        dates = pd.Series(data.index.to_numpy())
         is_datetime = False
     else:
-        dates = pd.to_datetime(tvec)
+        dates = pd.Series(time_index(tvec))
         is_datetime = True
 
+    if downsample is None:
+        downsample = len(dates) > DOWNSAMPLE_THRESHOLD
+
+    # Zones plotted one by one, and the sum of the zones of data for the combined plot
+    columns = list(data.columns) if isinstance(zones, str) else zone_columns(zones)
+    if zones == "all":
+        combined = data.to_numpy().sum(axis=1)
+
     date_locators = {"minute": md.MinuteLocator, "hour": md.HourLocator, "day": md.DayLocator, "month": md.MonthLocator}
     date_format = {"minute": '%Y-%m-%d %H:%M', "hour": '%Y-%m-%d %H:%M', "day": '%Y-%m-%d', "month": '%Y-%m', "hour of the day": '%H'}
 
     if len(dates) > 25:
         if zones == "all":
             fig_width = 10
-            fig, ax = plt.subplots(figsize=(10, 5))
+            fig, ax = make_subplots(1, 1, reuse=output is not None)
             fig.suptitle('Plot of Power Consumption', fontsize=16)
-            ax.plot(dates.to_numpy(),data["zone 1"].to_numpy()+data["zone 2"].to_numpy()+data["zone 3"].to_numpy()+data["zone 4"].to_numpy())
+            plot_line(ax, dates.to_numpy(), combined, downsample)
+            if anomalies is not None and is_datetime:
+                anomalies.draw(ax, combined=combined, downsample=downsample)
 
             ax.set_title("Combined Zones")
-            ax.set_ylabel(unit)
+            set_unit_axis(ax, unit, scale)
             ax.set_xlabel("Minutes")
             if agg_by:
                 ax.set_xlabel(agg_by)
@@ -169,8 +943,11 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
 
             # Determine a proper tick frequency
             tick_frequency = len(dates) // 20
-            # Get tick locator according to aggregation
-            xtick_locator = date_locators[agg_by](interval=tick_frequency)
+            # Get tick locator according to aggregation. Long series use automatic ticks
+            if downsample:
+                xtick_locator = md.AutoDateLocator()
+            else:
+                xtick_locator = date_locators[agg_by](interval=tick_frequency)
             # Set the locator
             ax.xaxis.set_major_locator(xtick_locator)
 
@@ -181,30 +958,35 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
                 tick.set_horizontalalignment('right')
 
         else:
-            fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2,2, figsize=(10, 5))
-
-            ax1.set_title("Zone 1")
-            ax2.set_title("Zone 2")
-            ax3.set_title("Zone 3")
-            ax4.set_title("Zone 4")
+            fig, axes = make_subplots(*SUBPLOT_GRIDS[len(columns)], reuse=output is not None)
+            axes = np.ravel(axes)
+            # A 2 x 2 grid with 3 zones has an empty subplot
+            for ax in axes[len(columns):]:
+                ax.set_visible(False)
+            axes = axes[:len(columns)]
 
-            ax1.plot(dates.to_numpy(), data["zone 1"].to_numpy(), color=("blue"))
-            ax2.plot(dates.to_numpy(), data["zone 2"].to_numpy(), color=("red"))
-            ax3.plot(dates.to_numpy(), data["zone 3"].to_numpy(), color=("magenta"))
-            ax4.plot(dates.to_numpy(), data["zone 4"].to_numpy(), color=("green"))
+            for ax, column in zip(axes, columns):
+                ax.set_title(column.capitalize())
+                plot_line(ax, dates.to_numpy(), data[column].to_numpy(), downsample, color=ZONE_COLORS[column])
+                if anomalies is not None and is_datetime:
+                    anomalies.draw(ax, column, downsample=downsample)
 
             # Get formatter according to aggregation
             x_format = md.DateFormatter(date_format[agg_by])
 
             # Determine a proper tick frequency
             tick_frequency = len(dates) // 10
-            # Get tick locator according to aggregation
-            xtick_locator = date_locators[agg_by](interval=tick_frequency)
 
 
-            for ax in [ax1, ax2, ax3, ax4]:
+            for ax in axes:
+                # Get tick locator according to aggregation. Long series use automatic ticks
+                if downsample:
+                    xtick_locator = md.AutoDateLocator()
+                else:
+                    xtick_locator = date_locators[agg_by](interval=tick_frequency)
+
                 # Set labels
-                ax.set_ylabel(unit)
+                set_unit_axis(ax, unit, scale)
                 ax.set_xlabel(agg_by)
 
                 ax.set_ylim(0)
@@ -223,16 +1005,16 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
     else:
         # There are less than 25 datapoints and we substitute the Graph plot with a Bar plot
         if zones == "all":
-            fig, ax = plt.subplots(figsize=(10, 5))
+            fig, ax = make_subplots(1, 1, reuse=output is not None)
             fig.suptitle('Bar Plot of Power Consumption', fontsize=16)
-            ax.set_ylabel(unit)
+            set_unit_axis(ax, unit, scale)
             ax.set_xlabel("Minutes")
             if agg_by:
                 ax.set_xlabel(agg_by)
 
             ax.set_title("Combined Zones")
 
-            ax.bar(dates.to_numpy(), data["zone 1"].to_numpy()+data["zone 2"].to_numpy()+data["zone 3"].to_numpy()+data["zone 4"].to_numpy())
+            ax.bar(dates.to_numpy(), combined)
             ax.set_xticks(dates)
 
             # Only format ticks if is datetime
@@ -248,23 +1030,21 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
             ax.set_ylim(0)
 
         else:
-            fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2,2, figsize=(10, 5))
+            fig, axes = make_subplots(*SUBPLOT_GRIDS[len(columns)], reuse=output is not None)
             fig.suptitle('Bar Plot of Power Consumption', fontsize=16)
+            axes = np.ravel(axes)
+            for ax in axes[len(columns):]:
+                ax.set_visible(False)
+            axes = axes[:len(columns)]
 
-            ax1.set_title("Zone 1")
-            ax2.set_title("Zone 2")
-            ax3.set_title("Zone 3")
-            ax4.set_title("Zone 4")
-
-            ax1.bar(dates.to_numpy(), data["zone 1"].to_numpy(), color=("blue"))
-            ax2.bar(dates.to_numpy(), data["zone 2"].to_numpy(), color=("red"))
-            ax3.bar(dates.to_numpy(), data["zone 3"].to_numpy(), color=("magenta"))
-            ax4.bar(dates.to_numpy(), data["zone 4"].to_numpy(), color=("green"))
+            for ax, column in zip(axes, columns):
+                ax.set_title(column.capitalize())
+                ax.bar(dates.to_numpy(), data[column].to_numpy(), color=ZONE_COLORS[column])
 
 
-            for ax in [ax1, ax2, ax3, ax4]:
+            for ax in axes:
                 # Set labels
-                ax.set_ylabel(unit)
+                set_unit_axis(ax, unit, scale)
                 ax.set_xlabel(agg_by)
 
                 # y limit
@@ -286,7 +1066,18 @@ def visualize(data, tvec, zones, unit, agg_by="minute"):
                 # Set tick label size
                 ax.tick_params(labelsize=6)
 
-    plt.tight_layout()
+    # Drawing happens in tight_layout and savefig
+    with instrumentation.stage("draw", len(data)):
+        fig.tight_layout()
+
+        # Save the figure instead of showing it when exporting
+        if output is not None:
+            fig.savefig(output)
+    if output is not None:
+        return output
+
+    import matplotlib.pyplot as plt
+
     plt.show()
 
     return None
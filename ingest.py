@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+import functions as f
+from batch import FMODES, FileResult, expand_sources, print_report
+from measurements import Measurements
+
+# Number of bytes read from a source at a time
+BLOCK_SIZE = 4 * 1024 ** 2
+
+# Number of blocks of a source waiting to be parsed. The source is not read further until
+# its parser catches up, so a fast source never buffers more than this in memory
+QUEUE_SIZE = 4
+
+# Readers of the sources that are not local files, by URL scheme
+STREAM_READERS = {}
+
+
+def register_reader(scheme):
+    """
+    Decorator that registers the reader of the sources with a URL scheme, e.g. "tcp" for tcp://host:port.
+    A reader is an async generator function called with the source and the block size that yields
+    the bytes of the source as they arrive
+
+    Args:
+        scheme (str): the URL scheme
+    Return:
+        (function): the decorator
+    """
+    def decorator(reader):
+        STREAM_READERS[scheme] = reader
+        return reader
+
+    return decorator
+
+
+async def read_file(source, block_size=BLOCK_SIZE):
+    """
+    Read a local file block by block. The reads run in a thread, so the event loop is never blocked
+
+    Args:
+        source (str): the name of the file
+        block_size (int): number of bytes read at a time
+    Yield:
+        (bytes): the next block of the file
+    """
+    with open(source, "rb") as file:
+        while True:
+            block = await asyncio.to_thread(file.read, block_size)
+            if not block:
+                return
+            yield block
+
+
+async def read_connection(reader, writer, block_size):
+    """Yield the bytes of an open connection until the other side closes it, then close it"""
+    try:
+        while True:
+            block = await reader.read(block_size)
+            if not block:
+                return
+            yield block
+    finally:
+        writer.close()
+
+
+@register_reader("tcp")
+async def read_tcp(source, block_size=BLOCK_SIZE):
+    """
+    Read the bytes a server sends on a tcp://host:port connection until it closes the connection
+
+    Args:
+        source (str): the URL of the server
+        block_size (int): number of bytes read at a time
+    Yield:
+        (bytes): the bytes received
+    """
+    url = urlsplit(source)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port)
+    async for block in read_connection(reader, writer, block_size):
+        yield block
+
+
+@register_reader("http")
+async def read_http(source, block_size=BLOCK_SIZE):
+    """
+    Download an http:// URL. The request is HTTP/1.0, so the server sends the file as is
+    and closes the connection at the end
+
+    Args:
+        source (str): the URL of the file
+        block_size (int): number of bytes read at a time
+    Yield:
+        (bytes): the bytes of the file received
+    """
+    url = urlsplit(source)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    path = (url.path or "/") + ("?" + url.query if url.query else "")
+    writer.write("GET {} HTTP/1.0\r\nHost: {}\r\nConnection: close\r\n\r\n".format(path, url.netloc).encode())
+    await writer.drain()
+
+    status = await reader.readline()
+    if status.split(None, 2)[1:2] != [b"200"]:
+        writer.close()
+        raise OSError("{} returned {}".format(source, status.decode(errors="replace").strip() or "nothing"))
+    # Skip the headers
+    while (await reader.readline()).strip():
+        pass
+    async for block in read_connection(reader, writer, block_size):
+        yield block
+
+
+def open_source(source, block_size=BLOCK_SIZE):
+    """
+    Get the reader of a source
+
+    Args:
+        source (str): a local file or a URL with a registered scheme
+        block_size (int): number of bytes read at a time
+    Return:
+        (async generator): the blocks of bytes of the source
+    """
+    if "://" not in source:
+        return read_file(source, block_size)
+    scheme = urlsplit(source).scheme
+    if scheme not in STREAM_READERS:
+        raise ValueError("No reader for {} sources: {}".format(scheme, source))
+    return STREAM_READERS[scheme](source, block_size)
+
+
+def parse_block(block):
+    """
+    Parse complete lines of a meter file. Runs in a worker process
+
+    Args:
+        block (bytes): whole lines in the 10-column layout
+    Return:
+        (pandas DataFrame object): the rows with compact dtypes and NaN for corrupt measurements
+    """
+    chunk = pd.read_csv(io.BytesIO(block), header=None, names=f.COLUMNS, dtype=f.CHUNK_DTYPES)
+    return f.mask_corrupt(chunk)
+
+
+class StreamParser:
+    """
+    Cuts the bytes of one source into whole lines as they arrive and cleans the parsed rows
+    like load_measurements.
+
+    Forward fill and drop are cleaned chunk by chunk with a ChunkCleaner. Backward fill,
+    linear, zone fill and a gap limit depend on the end of the source (the last row decides
+    backward fill), so their rows are kept with NaN and filled with fill_measurements once
+    the source is done.
+
+    Args:
+        fmode (str): the requested data processing (see load_measurements)
+        max_gap (int): the gap limit of load_measurements
+    """
+
+    def __init__(self, fmode, max_gap=None):
+        self.fmode = fmode
+        self.max_gap = max_gap
+        self.incremental = max_gap is None and fmode in ["forward fill", "drop"]
+        self.cleaner = f.ChunkCleaner(fmode if self.incremental else None)
+        # An unfinished last line, completed by the next block
+        self.rest = b""
+        self.rows = 0
+        self.cleaned = []
+
+    def split(self, block):
+        """
+        Add received bytes
+
+        Args:
+            block (bytes): the next bytes of the source
+        Return:
+            (bytes): the lines completed by the bytes. Empty if no line was completed
+        """
+        data = self.rest + block
+        end = data.rfind(b"\n") + 1
+        self.rest = data[end:]
+        return data[:end]
+
+    def feed(self, chunk):
+        """
+        Clean the next parsed rows of the source
+
+        Args:
+            chunk (pandas DataFrame object): rows from parse_block, in the order of the source
+        """
+        # Rows are numbered like a file read by load_measurements
+        chunk.index = pd.RangeIndex(self.rows, self.rows + len(chunk))
+        self.rows += len(chunk)
+        self.cleaned.append(self.cleaner.feed(chunk))
+
+    def finish(self):
+        """
+        Clean the rows held back until the end of the source
+
+        Return:
+            (Measurements): the cleaned measurements of the source
+        """
+        rest = self.cleaner.finish()
+        if rest is not None:
+            self.cleaned.append(rest)
+        if self.cleaned:
+            df = pd.concat(self.cleaned)
+        else:
+            df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in f.CHUNK_DTYPES.items()})
+        counts = self.cleaner.counts
+
+        # The data processing that was applied, used for rows appended later (see effective_fmode)
+        fmode = self.cleaner.fmode
+        if not self.incremental:
+            fmode = self.fmode
+            if len(df) > 0:
+                if self.max_gap is None and fmode == "backward fill" and df.iloc[-1].isnull().values.any():
+                    fmode = "drop"
+                df, counts = f.fill_measurements(df, counts, self.fmode, self.max_gap)
+
+        # The rows were parsed with float32 zones
+        data = f.widen_zones(df[f.ZONE_COLUMNS])
+        dataset = Measurements.from_frames(df[f.TIME_COLUMNS], data, fmode, self.max_gap)
+        dataset.corruption_counts = counts
+        return dataset
+
+
+class SourceResult(FileResult):
+    """
+    The result of ingesting one source
+
+    Args:
+        filename (str): the source, a file name or a URL
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.bytes = 0
+        self.dataset = None
+
+
+async def ingest_source(source, fmode, max_gap=None, executor=None, block_size=BLOCK_SIZE, queue_size=QUEUE_SIZE):
+    """
+    Read, parse and clean one source. The bytes are read while earlier blocks are parsed in the
+    worker pool, through a queue of at most queue_size blocks
+
+    Args:
+        source (str): a local file or a URL with a registered scheme
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit of load_measurements
+        executor (concurrent.futures.Executor): the worker pool parsing the blocks
+        block_size (int): number of bytes read at a time
+        queue_size (int): number of blocks waiting to be parsed before the source is paused
+    Return:
+        (SourceResult): the measurements and timing of the source, or the error it raised
+    """
+    result = SourceResult(source)
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    parser = StreamParser(fmode, max_gap)
+
+    async def produce():
+        async for block in open_source(source, block_size):
+            result.bytes += len(block)
+            lines = parser.split(block)
+            if lines:
+                # Waits while the queue is full
+                await queue.put(lines)
+        # A last line without a line break
+        if parser.rest.strip():
+            await queue.put(parser.rest)
+        await queue.put(None)
+
+    async def consume():
+        while True:
+            lines = await queue.get()
+            if lines is None:
+                return
+            parser.feed(await loop.run_in_executor(executor, parse_block, lines))
+
+    tasks = [asyncio.ensure_future(produce()), asyncio.ensure_future(consume())]
+    try:
+        await asyncio.gather(*tasks)
+        # Filling the held back rows can take a while, so it runs outside the event loop
+        result.dataset = await asyncio.to_thread(parser.finish)
+        result.rows = len(result.dataset)
+    except Exception as e:
+        result.error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        # Stop the other task when one of them failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+async def ingest_async(sources, fmode, max_gap=None, executor=None, block_size=BLOCK_SIZE,
+                       queue_size=QUEUE_SIZE, max_open=None, progress=None):
+    """
+    Ingest many sources concurrently in the running event loop
+
+    Args:
+        sources (list): local files and URLs with a registered scheme
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit of load_measurements
+        executor (concurrent.futures.Executor): the worker pool parsing the blocks.
+            Default is the thread pool of the event loop
+        block_size (int): number of bytes read at a time
+        queue_size (int): number of blocks of a source waiting to be parsed
+        max_open (int): number of sources read at the same time. Default is all of them
+        progress (function): called with each SourceResult as soon as it is done
+    Return:
+        (list): a SourceResult per source, in the order of sources
+    """
+    limit = asyncio.Semaphore(max_open or max(len(sources), 1))
+
+    async def run(source):
+        async with limit:
+            result = await ingest_source(source, fmode, max_gap, executor, block_size, queue_size)
+        if progress is not None:
+            progress(result)
+        return result
+
+    return await asyncio.gather(*[run(source) for source in sources])
+
+
+def ingest(sources, fmode, max_gap=None, workers=None, block_size=BLOCK_SIZE, queue_size=QUEUE_SIZE,
+           max_open=None, progress=None):
+    """
+    Ingest many sources concurrently, parsing in a pool of worker processes
+
+    Args:
+        sources (list): local files, directories (all .csv files in them), glob patterns and URLs
+            with a registered scheme
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit of load_measurements
+        workers (int): number of worker processes. Default is the number of cores
+        block_size (int): number of bytes read at a time
+        queue_size (int): number of blocks of a source waiting to be parsed
+        max_open (int): number of sources read at the same time
+        progress (function): called with each SourceResult as soon as it is done
+    Return:
+        (list): a SourceResult per source
+    """
+    urls = [source for source in sources if "://" in source]
+    sources = expand_sources([source for source in sources if "://" not in source]) + urls
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return asyncio.run(ingest_async(sources, fmode, max_gap, executor, block_size, queue_size, max_open,
+                                        progress))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load many meter files and streams concurrently")
+    parser.add_argument("sources", nargs="+", help="meter files, directories, glob patterns or tcp:// and http:// URLs")
+    parser.add_argument("--fmode", choices=FMODES, default="drop", help="handling of corrupted data")
+    parser.add_argument("--max-gap", type=int, default=None,
+                        help="fill each zone separately and drop runs of more than MAX_GAP corrupt measurements")
+    parser.add_argument("--workers", type=int, default=None, help="number of parsing processes")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="bytes read from a source at a time")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="blocks of a source waiting to be parsed before reading pauses")
+    parser.add_argument("--max-open", type=int, default=None, help="number of sources read at the same time")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = ingest(args.sources, FMODES[args.fmode], args.max_gap, args.workers, args.block_size,
+                     args.queue_size, args.max_open)
+    if not results:
+        parser.error("no meter files found")
+    print_report(results)
+    print("Wall time: {:.3f} s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
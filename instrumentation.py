@@ -0,0 +1,180 @@
+import contextlib
+import cProfile
+import functools
+import inspect
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+# Stages are only recorded when enabled, otherwise an instrumented call costs one check
+ENABLED = False
+
+# Measure the peak memory of each stage with tracemalloc. Slows the stages down
+TRACE_MEMORY = False
+
+# The recorded stages in the order they started
+RECORDS = []
+
+# The stages that are running, innermost last, with the peak memory seen so far
+_RUNNING = []
+
+
+def enable(memory=False):
+    """
+    Start recording stages
+
+    Args:
+        memory (bool): also measure the peak memory of each stage with tracemalloc
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = True
+    TRACE_MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Stop recording stages. The records are kept"""
+    global ENABLED, TRACE_MEMORY
+    ENABLED = False
+    if TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    TRACE_MEMORY = False
+
+
+def reset():
+    """Delete the records"""
+    RECORDS.clear()
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    Record the wall time and peak memory of a block of code when recording is enabled
+
+    Args:
+        name (str): the name of the stage
+        rows (int): number of rows processed. Can also be set later on the yielded record
+    Yield:
+        (dict): the record of the stage, or None when recording is disabled
+    """
+    if not ENABLED:
+        yield None
+        return
+
+    record = {"stage": name, "depth": len(_RUNNING), "rows": rows, "seconds": None, "rows_per_sec": None,
+              "peak_mb": None}
+    baseline = 0
+    if TRACE_MEMORY:
+        current, peak = tracemalloc.get_traced_memory()
+        # The peak is reset for this stage, so the stages around it keep the peak seen so far
+        for running in _RUNNING:
+            running[1] = max(running[1], peak)
+        tracemalloc.reset_peak()
+        baseline = current
+    _RUNNING.append([record, 0])
+    # The record is filled in when the stage finishes
+    RECORDS.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _, peak = _RUNNING.pop()
+        if TRACE_MEMORY:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            record["peak_mb"] = (peak - baseline) / 1024 ** 2
+            if _RUNNING:
+                _RUNNING[-1][1] = max(_RUNNING[-1][1], peak)
+        if record["rows"] is not None and record["seconds"] > 0:
+            record["rows_per_sec"] = record["rows"] / record["seconds"]
+
+
+def instrument(name, rows=None):
+    """
+    Decorator that records every call of a function as a stage when recording is enabled
+
+    Args:
+        name (str): the name of the stage
+        rows (function): computes the number of rows processed from the arguments of the call
+            (a dict by parameter name) and its result
+    Return:
+        (function): the decorator
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    record["rows"] = rows(signature.bind(*args, **kwargs).arguments, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def summary_table(records=None):
+    """
+    Format the records as a table. Stages inside other stages are indented
+
+    Args:
+        records (list): the records. Default is every record
+    Return:
+        (str): the table
+    """
+    records = RECORDS if records is None else records
+    lines = ["{:<34} {:>11} {:>10} {:>14} {:>10}".format("Stage", "Rows", "Seconds", "Rows/sec", "Peak MB")]
+    for record in records:
+        lines.append("{:<34} {:>11} {:>10.4f} {:>14} {:>10}".format(
+            "  " * record["depth"] + record["stage"],
+            record["rows"] if record["rows"] is not None else "-", record["seconds"],
+            "{:.0f}".format(record["rows_per_sec"]) if record["rows_per_sec"] else "-",
+            "{:.1f}".format(record["peak_mb"]) if record["peak_mb"] is not None else "-"))
+    return "\n".join(lines)
+
+
+def export_json(filename, records=None):
+    """
+    Write the records as a JSON file
+
+    Args:
+        filename (str): the name of the file
+        records (list): the records. Default is every record
+    """
+    records = RECORDS if records is None else records
+    with open(filename, "w") as file:
+        json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "stages": records}, file, indent=2)
+
+
+def profile(function, *args, output=None, limit=25, **kwargs):
+    """
+    Run a function under cProfile
+
+    Args:
+        function (function): the function to run
+        *args: arguments of the function
+        output (str): file to write the profile to (readable with pstats or snakeviz).
+            Default is to print the functions with the most cumulative time
+        limit (int): number of functions printed
+        **kwargs: keyword arguments of the function
+    Return:
+        the result of the function
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        if output is not None:
+            profiler.dump_stats(output)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+            print(stream.getvalue())
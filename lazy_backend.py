@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+import functions as f
+from measurements import Measurements
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Length of the periods in the duration language of Polars
+PERIOD_EVERY = {"hour": "1h", "day": "1d", "month": "1mo"}
+
+
+class LazyMeasurements:
+    """
+    The cleaned measurements of a data file as a Polars query plan.
+
+    Nothing is read when the plan is built. Aggregates and statistics are computed by running the
+    plan with the streaming engine on all cores, so only the (small) results are brought into
+    pandas. The full data is only collected when it is asked for, e.g. to plot the minutes.
+
+    Args:
+        frame (polars LazyFrame): the plan of the cleaned rows with a "row" number, a "timestamp"
+            and the zone columns
+        zones (list): the zone columns of the plan
+        counts (polars LazyFrame): the plan of the number of corrupt measurements per zone
+    """
+
+    def __init__(self, frame, zones, counts):
+        self.frame = frame
+        self.zones = zones
+        self.counts_frame = counts
+        self._collected = None
+        self._corruption_counts = None
+        self._results = {}
+        self._maxima = {}
+
+    @classmethod
+    def scan(cls, filename, fmode, max_gap=None, start=None, end=None, zones=None):
+        """
+        Build the plan that loads and cleans a csv file like load_measurements
+
+        Args:
+            filename (str): the name of the data file
+            fmode (str): the requested data processing (see load_measurements)
+            max_gap (int): the gap limit of load_measurements
+            start (str or datetime): only keep the rows from this time on
+            end (str or datetime): only keep the rows before this time
+            zones (list): only keep these zones (see functions.zone_columns)
+        Return:
+            (LazyMeasurements): the measurements
+        """
+        if pl is None:
+            raise ImportError("The polars backend requires polars. Install it with: pip install polars")
+
+        columns = f.zone_columns(zones)
+        schema = {column: pl.Int32 for column in f.TIME_COLUMNS}
+        schema.update({column: pl.Float64 for column in f.ZONE_COLUMNS})
+        frame = pl.scan_csv(filename, has_header=False, schema=schema).with_row_index("row")
+        frame = frame.select(
+            "row",
+            # The days, hours, minutes and seconds are added like time_index does, so e.g. day 31 of a
+            # 30-day month rolls over into the next month
+            (pl.datetime("year", "month", 1, time_unit="ns") + pl.duration(
+                days=pl.col("day") - 1, hours="hour", minutes="minute", seconds="second")).alias("timestamp"),
+            # Corrupt measurements are null
+            *[pl.when(pl.col(column) == -1).then(None).otherwise(pl.col(column)).alias(column) for column in columns])
+
+        # The filters are pushed down into the scan
+        if start is not None:
+            frame = frame.filter(pl.col("timestamp") >= pd.Timestamp(start))
+        if end is not None:
+            frame = frame.filter(pl.col("timestamp") < pd.Timestamp(end))
+
+        counts = frame.select(pl.col(columns).is_null().sum())
+        return cls(clean_plan(frame, columns, fmode, max_gap), columns, counts)
+
+    def collect(self):
+        """The cleaned measurements as pandas Measurements. Collected on first use"""
+        if self._collected is None:
+            df = self.frame.collect(engine="streaming").to_pandas()
+            data = df[self.zones].set_axis(pd.Index(df["row"].to_numpy(np.int64)))
+            self._collected = Measurements(pd.DatetimeIndex(df["timestamp"]), data)
+        return self._collected
+
+    @property
+    def timestamps(self):
+        """One datetime64 timestamp per row. Collects the data"""
+        return self.collect().timestamps
+
+    @property
+    def data(self):
+        """N x Z matrix. Each row is a set of measurements. Collects the data"""
+        return self.collect().data
+
+    @property
+    def corruption_counts(self):
+        """Number of corrupt measurements per zone"""
+        if self._corruption_counts is None:
+            counts = self.counts_frame.collect(engine="streaming")
+            self._corruption_counts = pd.Series(counts.row(0), index=self.zones)
+        return self._corruption_counts
+
+    def __len__(self):
+        if self._collected is not None:
+            return len(self._collected)
+        return self.frame.select(pl.len()).collect(engine="streaming").item()
+
+    def aggregate_plan(self, period):
+        """
+        Build the plan of an aggregation
+
+        Args:
+            period (Str): "minute" (no aggregation), "hour", "day", "month" or "hour of the day"
+        Return:
+            (polars LazyFrame): a "timestamp" column and the aggregated zones, sorted by time
+        """
+        if period == "minute":
+            return self.frame.select("timestamp", *self.zones)
+        if period == "hour of the day":
+            # The mean of each hour of the day, placed on the first hour with data at that time of day
+            # like aggregate_measurements
+            hours = self.frame.group_by(pl.col("timestamp").dt.hour().alias("hour")).agg(
+                pl.col("timestamp").min(), *[pl.col(column).mean() for column in self.zones])
+            return hours.sort("hour").select(pl.col("timestamp").dt.truncate("1h"), "hour", *self.zones)
+        if period not in PERIOD_EVERY:
+            raise ValueError("Unknown aggregation period: {}".format(period))
+        return self.frame.group_by(pl.col("timestamp").dt.truncate(PERIOD_EVERY[period])).agg(
+            *[pl.col(column).sum() for column in self.zones]).sort("timestamp")
+
+    def aggregate(self, period):
+        """
+        Aggregate the measurements by running the plan. Results are memoized
+
+        Args:
+            period (Str): "hour", "day", "month" or "hour of the day"
+        Return:
+            (Measurements): the aggregated measurements, in the layout of aggregate_measurements
+        """
+        if period not in self._results:
+            df = self.aggregate_plan(period).collect(engine="streaming").to_pandas()
+            data = df[self.zones]
+            if period == "hour of the day":
+                data = data.set_axis(pd.Index(df["hour"].to_numpy(np.int64), name="hour"))
+            self._results[period] = Measurements(pd.DatetimeIndex(df["timestamp"]), data)
+        return self._results[period]
+
+    def maxima(self, period="minute"):
+        """
+        Get the maximum of each zone. The minutes are reduced in the plan without collecting them,
+        aggregations from their memoized results
+
+        Args:
+            period (Str): the aggregation period
+        Return:
+            (pandas Series object): the maximum of each zone in Wh
+        """
+        if period not in self._maxima:
+            if period == "minute":
+                maxima = self.frame.select(pl.col(self.zones).max()).collect(engine="streaming").row(0)
+                self._maxima[period] = pd.Series(maxima, index=self.zones, dtype=np.float64)
+            else:
+                self._maxima[period] = self.aggregate(period).data.max()
+        return self._maxima[period]
+
+    def unit(self, period="minute"):
+        """The unit to display the measurements or an aggregation of them in, and its number of Wh"""
+        return f.display_unit(self.maxima(period))
+
+    def statistics(self, period="minute"):
+        """
+        Compute the statistics of each zone and of all zones combined in the plan
+
+        Args:
+            period (Str): the aggregation period
+        Return:
+            (pandas DataFrame object): one row per zone and "All", with the columns of DataFrame.describe
+        """
+        frame = self.aggregate_plan(period).select(*self.zones, pl.sum_horizontal(self.zones).alias("All"))
+        columns = self.zones + ["All"]
+        statistics = {
+            "count": lambda column: pl.col(column).count().cast(pl.Float64),
+            "mean": lambda column: pl.col(column).mean(),
+            "std": lambda column: pl.col(column).std(),
+            "min": lambda column: pl.col(column).min(),
+            "25%": lambda column: pl.col(column).quantile(0.25, "linear"),
+            "50%": lambda column: pl.col(column).quantile(0.5, "linear"),
+            "75%": lambda column: pl.col(column).quantile(0.75, "linear"),
+            "max": lambda column: pl.col(column).max(),
+        }
+        result = frame.select([expression(column).alias("{}|{}".format(column, name))
+                               for column in columns for name, expression in statistics.items()])
+        values = np.array(result.collect(engine="streaming").row(0), dtype=np.float64)
+        return pd.DataFrame(values.reshape(len(columns), len(statistics)), index=columns, columns=list(statistics))
+
+
+def clean_plan(frame, columns, fmode, max_gap=None):
+    """
+    Add the processing of the corrupt measurements to a plan, with the same result as clean_measurements
+
+    Args:
+        frame (polars LazyFrame): the rows with null for corrupt measurements
+        columns (list): the zone columns
+        fmode (str): the requested data processing
+        max_gap (int): leave measurements in runs of more than max_gap corrupt measurements unfilled
+    Return:
+        (polars LazyFrame): the plan of the cleaned rows
+    """
+    # Without a gap limit, forward and backward fill drop all corrupt rows if the first or last row is corrupt
+    edge = None
+    if max_gap is None and fmode == "forward fill":
+        edge = pl.any_horizontal([pl.col(column).first().is_null() for column in columns])
+    elif max_gap is None and fmode == "backward fill":
+        edge = pl.any_horizontal([pl.col(column).last().is_null() for column in columns])
+
+    filled = {}
+    for column in columns:
+        zone = pl.col(column)
+        if fmode == "forward fill":
+            filled[column] = zone.forward_fill()
+        elif fmode == "backward fill":
+            filled[column] = zone.backward_fill()
+        elif fmode == "zone fill":
+            filled[column] = zone.forward_fill().backward_fill()
+        elif fmode == "linear":
+            # Interpolate in time and repeat the first and last valid measurement at the edges, like np.interp
+            filled[column] = zone.interpolate_by("timestamp").forward_fill().backward_fill()
+        elif fmode == "drop":
+            filled[column] = zone
+        else:
+            raise ValueError("Unknown fmode: {}".format(fmode))
+
+        if edge is not None:
+            filled[column] = pl.when(edge).then(zone).otherwise(filled[column])
+        if max_gap is not None:
+            # The length of the run of corrupt measurements each measurement belongs to
+            run_length = pl.len().over(zone.is_null().rle_id())
+            filled[column] = pl.when(zone.is_null() & (run_length > max_gap)).then(None).otherwise(filled[column])
+
+    frame = frame.with_columns(**filled)
+    # Rows that could not be filled are dropped
+    return frame.drop_nulls(columns)
@@ -1,11 +1,11 @@
-import functions as f
 import os
 import pathlib
+import sys
 
-# Get current working directory
-cwd = os.getcwd()
+import functions as f
+from measurements import load_dataset
 
-print("""
+BANNER = """
                     ___,-----.___
                 ,--'             `--.
                /                     \\
@@ -38,202 +38,236 @@ print("""
 | Johan Böcher Hanehøj, August Tollerup, Andreas Fiehn |
 |                                                      |
 ========================================================
-""")
-
-
-tvec = None
-data = None
-data_loaded = False
-tvec_a = None
-data_a = None
-data_aggregated = False
-aggregated_by = None
-unit = "Wh"
-
-# Start program loop
-while True:
-    # Options the user can pick from
-    options = [
-        "(1) Load data",
-        "(2) Aggregate data",
-        "(3) Display statistics",
-        "(4) Visualize electricity consumption",
-        "(5) Quit"
-    ]
-
-
-    # Get user input
-    action = input("\nWhat do you wish to do?\n{}\n".format(
-        "\n".join(options))).lower()
-
-    if action == "1":
-
-        while True:
-            # Ask user for filename. Has to be in same directory as script
-            filename = input("\nPlease enter the name of your data file (case sensitive).\nThe file must be in the same directory as the script.\nIf you wish to go back to the main menu enter \"back\"\n")
-
-            # Go back to main menu
-            if filename.lower() == "back":
-                print("\nLoad data aborted. Data has not been loaded \n")
-                break
-
-            # Full file path
-            file = cwd + "/" + filename
-
-            # Check if it is a csv file
-            if pathlib.Path(filename).suffix == ".csv":
-                # Check if file exists
-                if os.path.isfile(file):
-                    # Enter loop to get fmode from user
-                    while True:
-                        # Options to pick from
-                        fmode_options = [
-                            "(1) Forward fill",
-                            "(2) Backward fill",
-                            "(3) Drop",
-                            "(4) Back to main menu"
-                        ]
-
-                        # Ask for user input
-                        fmode = input("\nHow would you like to handle corrupted data?\n{}\n".format(
-                            "\n".join(fmode_options))).lower()
-
-                        # Check input
-                        if fmode in ["1", "2", "3"]:
-                            # Define options
-                            dict = {"1": "forward fill", "2": "backward fill", "3": "drop"}
-
-                            tvec, data = f.load_measurements(filename, dict[fmode])
-                            data_loaded = True
-
-                            # Reset aggregated data when new data is loaded
-                            data_aggregated = False
-                            data_a = None
-                            tvec_a = None
-
-                            print("\nData was loaded succesfully!\n")
-                            break
-                        elif fmode == "4":
-                            print("\nLoad data aborted. Data has not been loaded \n")
-                            break
-                        else:
-                            print("\nPlease enter a valid way to handle corrupted data\n")
-                            continue
-                        # Data is saved. Break out of the loop
-                        break
-                else:
-                    print("\nFile does not exist!\n")
-                    continue
-            else:
-                print("\nPlease provide a .csv file\n")
-                continue
-            break
+"""
+
+# Files larger than this (in bytes) are streamed in chunks of CHUNK_SIZE rows
+LARGE_FILE_SIZE = 100 * 1024 ** 2
+CHUNK_SIZE = 1_000_000
+
+
+def menu():
+    """Run the interactive menu"""
+    # Get current working directory
+    cwd = os.getcwd()
+
+    print(BANNER)
+
+    dataset = None
+    tvec = None
+    data = None
+    data_loaded = False
+    tvec_a = None
+    data_a = None
+    data_aggregated = False
+    aggregated_by = None
+    # Display unit of the data and its number of Wh. The data itself stays in Wh
+    unit = "Wh"
+    scale = 1
+
+    # Start program loop
+    while True:
+        # Options the user can pick from
+        options = [
+            "(1) Load data",
+            "(2) Aggregate data",
+            "(3) Display statistics",
+            "(4) Visualize electricity consumption",
+            "(5) Quit"
+        ]
+
+
+        # Get user input
+        action = input("\nWhat do you wish to do?\n{}\n".format(
+            "\n".join(options))).lower()
+
+        if action == "1":
 
-    elif action == "2":
-
-        if not data_loaded:
-            print("\nPlease load data first!\n")
-        else:
             while True:
-                agg_options = [
-                "(1) Consumption per minute (no aggregation)",
-                "(2) Consumption per hour",
-                "(3) Consumption per day",
-                "(4) Consumption per month",
-                "(5) Hour-of-day consumption (hourly average)",
-                "(6) Back to main menu"
-                ]
-
-                period = input("\nWhat period would you like to aggregate for \n{}\n".format("\n".join(agg_options)))
-
-                # Aggregate by minute
-                if period == "1":
-                    # If aggregation "minute" is chosen data is not aggregated
-                    tvec_a = tvec
-                    data_a = data
-                    aggregated_by  = "minute"
-                    data_aggregated = True
-
-                    # Convert unit to kWh if any of the data points are bigger than 10 kWh
-                    if (data_a > 10000).any().any():
-                        data_a = data_a / 1000
-                        unit = "kWh"
-                        print("\nUnit converted to kWh")
-                    else:
-                        unit = "Wh"
-
-                    print("\nAggregated by minute (No aggregation has been applied)\n")
+                # Ask user for filename. Has to be in same directory as script
+                filename = input("\nPlease enter the name of your data file (case sensitive).\nThe file must be in the same directory as the script.\nIf you wish to go back to the main menu enter \"back\"\n")
 
+                # Go back to main menu
+                if filename.lower() == "back":
+                    print("\nLoad data aborted. Data has not been loaded \n")
                     break
-                elif period in ["2", "3", "4", "4", "5"]:
-                    # Define options
-                    dict = {"2": "hour", "3": "day", "4": "month", "5": "hour of the day"}
-
-                    tvec_a, data_a = f.aggregate_measurements(tvec, data, dict[period])
-                    aggregated_by = dict[period]
-                    data_aggregated = True
-
-                    # Convert unit to kWh if any of the data points are bigger than 10 kWh
-                    if (data_a > 10000).any().any():
-                        data_a = data_a / 1000
-                        unit = "kWh"
-                        print("\nUnit converted to kWh")
-                    else:
-                        unit = "Wh"
 
-                    print("\nData aggregated succesfully!\n")
-                    break
-                elif period == "6":
-                    print("\nData has not been aggregated\n")
-                    break
+                # Full file path
+                file = cwd + "/" + filename
+
+                # Check if it is a csv file
+                if pathlib.Path(filename).suffix == ".csv":
+                    # Check if file exists
+                    if os.path.isfile(file):
+                        # Enter loop to get fmode from user
+                        while True:
+                            # Options to pick from
+                            fmode_options = [
+                                "(1) Forward fill",
+                                "(2) Backward fill",
+                                "(3) Drop",
+                                "(4) Linear interpolation in time",
+                                "(5) Fill each zone separately",
+                                "(6) Back to main menu"
+                            ]
+
+                            # Ask for user input
+                            fmode = input("\nHow would you like to handle corrupted data?\n{}\n".format(
+                                "\n".join(fmode_options))).lower()
+
+                            # Check input
+                            if fmode in ["1", "2", "3", "4", "5"]:
+                                # Define options
+                                dict = {"1": "forward fill", "2": "backward fill", "3": "drop", "4": "linear",
+                                        "5": "zone fill"}
+
+                                # Stream large files in chunks to limit peak memory
+                                # Previously loaded files are read from the binary cache
+                                if os.path.getsize(file) > LARGE_FILE_SIZE:
+                                    dataset = load_dataset(filename, dict[fmode], chunksize=CHUNK_SIZE, cache=True)
+                                else:
+                                    dataset = load_dataset(filename, dict[fmode], cache=True)
+                                # Time is carried as one timestamp per row instead of the 6-column matrix
+                                tvec, data = dataset.timestamps, dataset.data
+                                data_loaded = True
+
+                                # Reset aggregated data when new data is loaded
+                                data_aggregated = False
+                                data_a = None
+                                tvec_a = None
+                                unit, scale = dataset.unit()
+
+                                print("\nData was loaded succesfully!\n")
+                                if dataset.corruption_counts.any():
+                                    print("Corrupt measurements per zone:\n{}\n".format(
+                                        dataset.corruption_counts.to_string()))
+                                break
+                            elif fmode == "6":
+                                print("\nLoad data aborted. Data has not been loaded \n")
+                                break
+                            else:
+                                print("\nPlease enter a valid way to handle corrupted data\n")
+                                continue
+                            # Data is saved. Break out of the loop
+                            break
+                    else:
+                        print("\nFile does not exist!\n")
+                        continue
                 else:
-                    print("Please enter a valid aggregate option")
+                    print("\nPlease provide a .csv file\n")
                     continue
+                break
 
-    elif action == "3":
-        if not data_loaded:
-            print("\nPlease load data first!\n")
-        else:
-            if data_aggregated:
-                print("\nConsumption per {} in {}\n".format(aggregated_by, unit))
-                print(aggregated_by)
-                f.print_statistics(tvec_a, data_a)
-            else:
-                print("\nConsumption per minute in {}\n".format(unit))
-                f.print_statistics(tvec, data)
+        elif action == "2":
 
+            if not data_loaded:
+                print("\nPlease load data first!\n")
+            else:
+                while True:
+                    agg_options = [
+                    "(1) Consumption per minute (no aggregation)",
+                    "(2) Consumption per hour",
+                    "(3) Consumption per day",
+                    "(4) Consumption per month",
+                    "(5) Hour-of-day consumption (hourly average)",
+                    "(6) Back to main menu"
+                    ]
+
+                    period = input("\nWhat period would you like to aggregate for \n{}\n".format("\n".join(agg_options)))
+
+                    # Aggregate by minute
+                    if period == "1":
+                        # If aggregation "minute" is chosen data is not aggregated
+                        tvec_a = tvec
+                        data_a = data
+                        aggregated_by  = "minute"
+                        data_aggregated = True
+
+                        # Display in kWh if any of the data points are bigger than 10 kWh
+                        unit, scale = dataset.unit()
+                        if unit == "kWh":
+                            print("\nUnit converted to kWh")
+
+                        print("\nAggregated by minute (No aggregation has been applied)\n")
 
-    elif action == "4":
-        if data_loaded:
-            while True:
-                plot_options = [
-                "(1) Combined zones",
-                "(2) Each zone",
-                "(3) Back"
-                ]
-                choice = input("Would you like to plot the data combined (all zones) or each zone? \n{}\n".format("\n".join(plot_options)))
-
-                if choice == "1":
-                    if data_aggregated:
-                        f.visualize(data_a, tvec_a, "all", unit, aggregated_by)
-                    else:
-                        f.visualize(data, tvec, "all", unit)
-                    break
-                elif choice == "2":
-                    if data_aggregated:
-                        f.visualize(data_a, tvec_a, "each", unit, aggregated_by)
+                        break
+                    elif period in ["2", "3", "4", "4", "5"]:
+                        # Define options
+                        dict = {"2": "hour", "3": "day", "4": "month", "5": "hour of the day"}
+
+                        # The aggregates of the loaded dataset are computed once and reused
+                        aggregated = dataset.aggregate(dict[period])
+                        tvec_a, data_a = aggregated.timestamps, aggregated.data
+                        aggregated_by = dict[period]
+                        data_aggregated = True
+
+                        # Display in kWh if any of the data points are bigger than 10 kWh.
+                        # The maximum of each zone is computed once per period from the memoized aggregates
+                        unit, scale = dataset.unit(dict[period])
+                        if unit == "kWh":
+                            print("\nUnit converted to kWh")
+
+                        print("\nData aggregated succesfully!\n")
+                        break
+                    elif period == "6":
+                        print("\nData has not been aggregated\n")
+                        break
                     else:
-                        f.visualize(data, tvec, "each", unit)
-                    break
+                        print("Please enter a valid aggregate option")
+                        continue
+
+        elif action == "3":
+            if not data_loaded:
+                print("\nPlease load data first!\n")
+            else:
+                if data_aggregated:
+                    print("\nConsumption per {} in {}\n".format(aggregated_by, unit))
+                    print(aggregated_by)
+                    f.print_statistics(tvec_a, data_a, scale=scale)
                 else:
-                    print("\n Please specify a correct option")
-                    continue
+                    print("\nConsumption per minute in {}\n".format(unit))
+                    f.print_statistics(tvec, data, scale=scale)
+
+
+        elif action == "4":
+            if data_loaded:
+                while True:
+                    plot_options = [
+                    "(1) Combined zones",
+                    "(2) Each zone",
+                    "(3) Back"
+                    ]
+                    choice = input("Would you like to plot the data combined (all zones) or each zone? \n{}\n".format("\n".join(plot_options)))
+
+                    if choice == "1":
+                        if data_aggregated:
+                            f.visualize(data_a, tvec_a, "all", unit, aggregated_by, scale=scale)
+                        else:
+                            f.visualize(data, tvec, "all", unit, scale=scale)
+                        break
+                    elif choice == "2":
+                        if data_aggregated:
+                            f.visualize(data_a, tvec_a, "each", unit, aggregated_by, scale=scale)
+                        else:
+                            f.visualize(data, tvec, "each", unit, scale=scale)
+                        break
+                    else:
+                        print("\n Please specify a correct option")
+                        continue
+            else:
+                print("\nPlease load data first!\n")
+
+        elif action == "5":
+            print("\nThank you for using our program :)")
+            # Exit program
+            exit()
         else:
-            print("\nPlease load data first!\n")
+            print("Please pick a valid option")
+
 
-    elif action == "5":
-        print("\nThank you for using our program :)")
-        # Exit program
-        exit()
+if __name__ == "__main__":
+    # Run the command line interface if arguments are given, otherwise the interactive menu
+    if len(sys.argv) > 1:
+        import cli
+        cli.main()
     else:
-        print("Please pick a valid option")
+        menu()
@@ -0,0 +1,276 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import cache as measurement_cache
+import functions as f
+import instrumentation
+from aggregation import AggregationEngine
+from archive import MeterArchive, is_archive
+from fast_csv import complete_lines
+
+
+class Measurements:
+    """
+    A set of cleaned measurements with one datetime64 timestamp per row.
+
+    The timestamps are built once when the data is loaded. The N x 6 time matrix used by the
+    functions in functions.py is only produced when it is asked for.
+
+    New rows can be appended with append or append_file. They are cleaned with the same fmode,
+    continuing from the last row, and the aggregates are updated with the new rows only.
+
+    Args:
+        timestamps (pandas DatetimeIndex object): N timestamps
+        data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        fmode (str): the data processing used for appended rows
+        max_gap (int): the gap limit used for appended rows (see load_measurements)
+    """
+
+    def __init__(self, timestamps, data, fmode=None, max_gap=None):
+        # Appended rows are kept as separate segments and joined on first use
+        self._timestamps = [pd.DatetimeIndex(timestamps)]
+        self._data = [data]
+        self._tvec = None
+        self._engine = None
+        # Aggregated measurements by period and the maximum of each zone, computed once
+        self._aggregates = {}
+        self._maxima = None
+
+        # State for appending rows
+        self.fmode = fmode
+        self.max_gap = max_gap
+        self.cleaner = None
+        self.next_index = data.index.max() + 1 if len(data) > 0 else 0
+        self.source = None
+        self.source_offset = 0
+        # Number of corrupt measurements per zone in the loaded file
+        self.corruption_counts = None
+
+    @classmethod
+    def from_frames(cls, tvec, data, fmode=None, max_gap=None):
+        """
+        Create measurements from a N x 6 time matrix and a N x 4 data matrix
+
+        Args:
+            tvec (pandas DataFrame object): N x 6 matrix. Each row is a time vector
+            data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+            fmode (str): the data processing used for appended rows
+            max_gap (int): the gap limit used for appended rows
+        Return:
+            (Measurements): the measurements
+        """
+        return cls(f.time_index(tvec), data, fmode, max_gap)
+
+    @property
+    def timestamps(self):
+        """One datetime64 timestamp per row"""
+        if len(self._timestamps) > 1:
+            self._timestamps = [self._timestamps[0].append(self._timestamps[1:])]
+        return self._timestamps[0]
+
+    @property
+    def data(self):
+        """N x 4 matrix. Each row is a set of measurements"""
+        if len(self._data) > 1:
+            self._data = [pd.concat(self._data)]
+        return self._data[0]
+
+    @property
+    def tvec(self):
+        """The N x 6 time matrix view of the timestamps. Built on first use"""
+        if self._tvec is None:
+            self._tvec = f.time_matrix(self.timestamps, index=self.data.index)
+        return self._tvec
+
+    def __len__(self):
+        return sum(len(data) for data in self._data)
+
+    @property
+    def engine(self):
+        """The aggregation engine of the measurements. Built on first use and then reused"""
+        if self._engine is None:
+            self._engine = AggregationEngine(self.timestamps, self.data)
+        return self._engine
+
+    @instrumentation.instrument("Measurements.aggregate", rows=lambda arguments, result: len(arguments["self"]))
+    def aggregate(self, period):
+        """
+        Aggregate the measurements. Results are memoized, so switching periods is free
+
+        Args:
+            period (Str): "hour", "day", "month" or "hour of the day"
+        Return:
+            (Measurements): the aggregated measurements
+        """
+        if period not in self._aggregates:
+            timestamps, data = self.engine.aggregate(period)
+            self._aggregates[period] = Measurements(timestamps, data)
+        return self._aggregates[period]
+
+    def maxima(self, period="minute"):
+        """
+        Get the maximum of each zone. Computed once per period, from the memoized aggregates
+
+        Args:
+            period (Str): "minute" (the measurements themselves), "hour", "day", "month" or "hour of the day"
+        Return:
+            (pandas Series object): the maximum of each zone in Wh
+        """
+        if period != "minute":
+            return self.aggregate(period).maxima()
+        if self._maxima is None:
+            self._maxima = self.data.max()
+        return self._maxima
+
+    def unit(self, period="minute"):
+        """
+        Get the unit to display the measurements or an aggregation of them in
+
+        Args:
+            period (Str): the aggregation period
+        Return:
+            (tuple): the unit, "Wh" or "kWh", and its number of Wh (see functions.display_unit)
+        """
+        return f.display_unit(self.maxima(period))
+
+    def append(self, rows):
+        """
+        Append new rows in the 10-column file layout. The rows are cleaned with the fmode of the
+        measurements, continuing from the last row, and only the aggregates they fall into are updated.
+        Rows whose corrupt measurements need a later valid measurement (backward fill, linear, and
+        gaps that may grow past the gap limit) are held back until it arrives.
+
+        Args:
+            rows (pandas DataFrame object): M x 10 matrix with -1 marking corrupt measurements
+        Return:
+            (int): the number of rows added to the measurements
+        """
+        rows = rows.set_axis(f.COLUMNS, axis=1)
+        rows.index = pd.RangeIndex(self.next_index, self.next_index + len(rows))
+        self.next_index += len(rows)
+        rows[f.ZONE_COLUMNS] = rows[f.ZONE_COLUMNS].mask(rows[f.ZONE_COLUMNS] == -1)
+
+        cleaned = self.get_cleaner().feed(rows)
+        if len(cleaned) == 0:
+            return 0
+
+        timestamps = f.time_index(cleaned[f.TIME_COLUMNS])
+        data = cleaned[f.ZONE_COLUMNS].astype(self._data[0].dtypes.to_dict())
+        self._timestamps.append(timestamps)
+        self._data.append(data)
+        self._tvec = None
+        self._aggregates = {}
+        if self._maxima is not None:
+            self._maxima = np.fmax(self._maxima, data.max())
+        if self._engine is not None:
+            self._engine.update(timestamps, data)
+        return len(data)
+
+    def append_file(self, filename=None):
+        """
+        Append the rows written to a data file since it was last read. Only the new bytes are read
+
+        Args:
+            filename (str): the name of the data file. Default is the file the measurements were loaded from
+        Return:
+            (int): the number of rows added to the measurements
+        """
+        if filename is not None and filename != self.source:
+            self.source = filename
+            self.source_offset = 0
+
+        with open(self.source, "rb") as file:
+            file.seek(self.source_offset)
+            tail = file.read()
+        # Leave an unfinished last line for the next call
+        complete = tail.rfind(b"\n") + 1
+        self.source_offset += complete
+        if tail[:complete].strip() == b"":
+            return 0
+
+        rows = pd.read_csv(io.BytesIO(tail[:complete]), header=None)
+        return self.append(rows)
+
+    def get_cleaner(self):
+        """The ChunkCleaner or ImputeCleaner used for appended rows, seeded with the last row of the measurements"""
+        if self.cleaner is None and (self.fmode in f.IMPUTE_MODES or self.max_gap is not None):
+            # Rows appended to files cleaned by impute get the same gap handling, per zone
+            self.cleaner = f.ImputeCleaner(self.fmode, self.max_gap)
+            if len(self) > 0:
+                self.cleaner.seed(self._timestamps[-1][-1], self._data[-1].iloc[-1])
+        elif self.cleaner is None:
+            self.cleaner = f.ChunkCleaner(self.fmode)
+            if len(self) > 0:
+                self.cleaner.first_chunk = False
+            # Forward fill continues from the last row
+            if self.fmode == "forward fill" and len(self) > 0:
+                last = self._data[-1].iloc[[-1]]
+                self.cleaner.carry = pd.concat([f.time_matrix(self._timestamps[-1][-1:], index=last.index), last],
+                                               axis=1)
+        return self.cleaner
+
+
+def effective_fmode(filename, fmode, max_gap=None, size=None):
+    """
+    Get the data processing that load_measurements applied to a file. Forward and backward fill
+    drop all corrupt measurements if the first or last row of the file is corrupt
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit given to load_measurements
+        size (int): number of bytes of the file that were loaded. Default is the whole file
+    Return:
+        (str): the data processing that was applied
+    """
+    # Files cleaned by impute keep their fmode, corrupt edge rows do not change it
+    if max_gap is not None or fmode not in ("forward fill", "backward fill"):
+        return fmode
+    if is_archive(filename):
+        # Archives keep the corrupt measurements as -1 in their records
+        zones = MeterArchive(filename).zones
+        if len(zones) == 0:
+            return fmode
+        edge = zones[0 if fmode == "forward fill" else -1].tolist()
+    elif fmode == "forward fill":
+        edge = pd.read_csv(filename, header=None, nrows=1).iloc[0].tolist()
+    else:
+        edge = f.read_last_row(filename, size)
+    return "drop" if -1 in edge else fmode
+
+
+def load_dataset(filename, fmode, **kwargs):
+    """
+    Load a data file as Measurements
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        **kwargs: passed on to load_measurements (chunksize, cache, cache_dir, max_gap, engine)
+    Return:
+        (Measurements): the cleaned measurements
+    """
+    # Only the complete lines written so far are loaded, the rest is picked up by append_file
+    if is_archive(filename):
+        size, lines = os.path.getsize(filename), None
+    else:
+        lines = None
+        if kwargs.get("cache"):
+            # The cache entry of the file as it is now knows its complete lines, so the file is not scanned
+            key = f.measurement_key(fmode, kwargs.get("max_gap"), kwargs.get("chunksize"), kwargs.get("engine"),
+                                    complete_lines=True)
+            lines = measurement_cache.read_lines(filename, key, kwargs.get("cache_dir"))
+        if lines is None:
+            lines = complete_lines(filename)
+        size = lines[0]
+    tvec, data, counts = f.load_measurements(filename, fmode, return_counts=True, lines=lines, **kwargs)
+
+    max_gap = kwargs.get("max_gap")
+    dataset = Measurements.from_frames(tvec, data, effective_fmode(filename, fmode, max_gap, size), max_gap)
+    dataset.corruption_counts = counts
+    dataset.source = filename
+    dataset.source_offset = size
+    return dataset
@@ -0,0 +1,214 @@
+import os
+
+import functions as f
+from measurements import load_dataset
+from query import query_dataset
+from rollup import is_aligned, load_rollups
+
+# Execution backends that can be chosen when a file is loaded
+BACKENDS = ["pandas", "polars"]
+
+
+class Pipeline:
+    """
+    Load, aggregate, print statistics for and plot one meter file without the interactive menu.
+
+    The file is loaded on first use and the aggregates are computed once per period, so the
+    same pipeline can be asked for several periods and actions.
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        chunksize (int): stream the file in chunks of this many rows
+        cache (bool): load through the binary cache
+        max_gap (int): drop rows in runs of more than max_gap corrupt measurements instead of filling them
+        engine (str): csv reader of fast_csv to parse the file with. Default is pd.read_csv
+        start (str): only load the measurements from this time on
+        end (str): only load the measurements before this time
+        zones (list): only load these zones (numbers 1 to 4)
+        backend (str): "pandas", or "polars" to run the loading, aggregation and statistics as a lazy
+            Polars query plan with streaming execution (see lazy_backend.py)
+        rollups (bool): answer hour, day, month and hour of the day aggregates from the rollup store
+            written next to the file (see rollup.py) instead of the raw measurements
+    """
+
+    def __init__(self, filename, fmode="drop", chunksize=None, cache=False, max_gap=None, engine=None, start=None,
+                 end=None, zones=None, backend="pandas",
+                 rollups=False):
+        self.filename = filename
+        self.fmode = fmode
+        self.chunksize = chunksize
+        self.cache = cache
+        self.max_gap = max_gap
+        self.engine = engine
+        self.start = start
+        self.end = end
+        self.zones = zones
+        self.backend = backend
+        self.rollups = rollups
+        self._dataset = None
+        self._rollup_store = None
+        self._anomalies = {}
+
+    @property
+    def dataset(self):
+        """The loaded Measurements. Loaded on first use"""
+        if self._dataset is None and self.backend == "polars":
+            # polars is only imported when it is used
+            from lazy_backend import LazyMeasurements
+
+            self._dataset = LazyMeasurements.scan(self.filename, self.fmode, self.max_gap, self.start, self.end,
+                                                  self.zones)
+        elif self._dataset is None and (self.start or self.end or self.zones):
+            # Only the requested rows and zones are read
+            self._dataset = query_dataset(self.filename, self.fmode, self.start, self.end, self.zones, self.max_gap)
+        elif self._dataset is None:
+            self._dataset = load_dataset(self.filename, self.fmode, chunksize=self.chunksize, cache=self.cache,
+                                         max_gap=self.max_gap, engine=self.engine)
+        return self._dataset
+
+    @property
+    def rollup_store(self):
+        """The RollupStore of the file. Built and written next to the file on first use, then reused"""
+        if self._rollup_store is None:
+            self._rollup_store = load_rollups(self.filename, self.fmode, self.max_gap, self.zones,
+                                              chunksize=self.chunksize, engine=self.engine)
+        return self._rollup_store
+
+    def uses_rollups(self, period):
+        """
+        Check if an aggregate is answered from the rollup store. The stored tiers hold whole hours,
+        so a time range that does not start and end on an hour is aggregated from the measurements.
+        The tiers are built from the whole file, while a time range is cleaned on its own (see
+        query_measurements). Only drop cleans every row by itself, so other fmodes answer a time
+        range from the measurements as well
+
+        Args:
+            period (Str): the aggregation period
+        Return:
+            (bool): True if the rollup store answers it
+        """
+        if not self.rollups or period == "minute":
+            return False
+        if (self.start or self.end) and self.fmode != "drop":
+            return False
+        return all(time is None or is_aligned(time, "hour") for time in (self.start, self.end))
+
+    @property
+    def corruption_counts(self):
+        """Number of corrupt measurements per zone"""
+        # The rollups hold the counts of the whole file
+        if self.rollups and not (self.start or self.end):
+            return self.rollup_store.corruption_counts[f.zone_columns(self.zones)]
+        return self.dataset.corruption_counts
+
+    def aggregate(self, period="minute"):
+        """
+        Aggregate the data and choose the unit to display it in. The data stays in Wh,
+        it is only scaled when it is output
+
+        Args:
+            period (Str): "minute" (no aggregation), "hour", "day", "month" or "hour of the day"
+        Return:
+            (tuple): timestamps and data (in Wh) of the aggregated data, its display unit and
+                the number of Wh per unit
+        """
+        if self.uses_rollups(period):
+            # Answered from the stored tiers, without loading the measurements
+            timestamps, data = self.rollup_store.aggregate(period, self.start, self.end)
+            data = data[f.zone_columns(self.zones)]
+            unit, scale = f.display_unit(data.max())
+        elif period == "minute":
+            timestamps, data = self.dataset.timestamps, self.dataset.data
+            unit, scale = self.dataset.unit()
+        else:
+            aggregated = self.dataset.aggregate(period)
+            timestamps, data = aggregated.timestamps, aggregated.data
+            unit, scale = self.dataset.unit(period)
+        return (timestamps, data, unit, scale)
+
+    def print_statistics(self, period="minute", exact=None):
+        """
+        Print the statistics of the aggregated data
+
+        Args:
+            period (Str): the aggregation period
+            exact (bool): compute exact quartiles. Default depends on the size of the data.
+                The polars backend always computes exact quartiles
+        """
+        if self.backend == "polars" and not self.uses_rollups(period):
+            # The statistics are computed in the query plan, only the table is brought into pandas
+            table = self.dataset.statistics(period)
+            unit, scale = f.display_unit(table.loc[self.dataset.zones, "max"])
+            print("\nConsumption per {} in {}\n".format(period, unit))
+            print(f.format_statistics(f.scale_statistics(table, scale)))
+            return
+
+        timestamps, data, unit, scale = self.aggregate(period)
+        print("\nConsumption per {} in {}\n".format(period, unit))
+        f.print_statistics(timestamps, data, exact, scale=scale)
+
+    def anomalies(self, period="minute", window=None, threshold=None):
+        """
+        Find the peaks and the runs of zero and corrupt measurements of the aggregated data. Memoized
+
+        Args:
+            period (Str): the aggregation period
+            window (int): number of rows in the rolling window. Default is anomalies.WINDOW
+            threshold (float): z-score above which a measurement is a peak. Default is anomalies.Z_THRESHOLD
+        Return:
+            (anomalies.Anomalies): the rolling statistics, peaks and runs
+        """
+        from anomalies import WINDOW, Z_THRESHOLD, Anomalies, corruption_runs
+
+        window = WINDOW if window is None else window
+        threshold = Z_THRESHOLD if threshold is None else threshold
+        key = (period, window, threshold)
+        if key not in self._anomalies:
+            timestamps, data, unit, scale = self.aggregate(period)
+            # The corrupt measurements are found in the raw rows of the file
+            corruption = corruption_runs(self.filename, start=self.start, end=self.end, zones=self.zones)
+            self._anomalies[key] = Anomalies(timestamps, data, window, threshold, corruption=corruption)
+        return self._anomalies[key]
+
+    def plot(self, zones="all", period="minute", output=None, anomalies=None):
+        """
+        Plot the aggregated data
+
+        Args:
+            zones (str or list): "all" for the combined zones, "each" for one plot per zone or a list of zones
+            period (Str): the aggregation period
+            output (str): save the plot to this file without a display instead of showing it
+            anomalies (anomalies.Anomalies): peaks and runs to overlay, from anomalies with the same period
+        Return:
+            (str): the output file, or None if the plot was shown
+        """
+        timestamps, data, unit, scale = self.aggregate(period)
+        return f.visualize(data, timestamps, zones, unit, period, output=output, scale=scale, anomalies=anomalies)
+
+    def export(self, directory, period="minute"):
+        """
+        Write the aggregated data and its statistics as csv files
+
+        Args:
+            directory (str): the output directory
+            period (Str): the aggregation period
+        Return:
+            (list): the names of the written files
+        """
+        from streaming_stats import compute_statistics
+
+        timestamps, data, unit, scale = self.aggregate(period)
+        os.makedirs(directory, exist_ok=True)
+        name = "{}_{}".format(os.path.splitext(os.path.basename(self.filename))[0], period.replace(" ", "_"))
+
+        table = data if period == "hour of the day" else data.set_axis(timestamps)
+        # The files are written in the display unit
+        if scale != 1:
+            table = table / scale
+        data_file = os.path.join(directory, "{}_{}.csv".format(name, unit))
+        table.to_csv(data_file)
+        statistics_file = os.path.join(directory, "{}_statistics.csv".format(name))
+        statistics = compute_statistics(data, exact=len(data) <= f.EXACT_STATISTICS_ROWS).table()
+        f.scale_statistics(statistics, scale).to_csv(statistics_file)
+        return [data_file, statistics_file]
@@ -0,0 +1,193 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import functions as f
+from archive import MeterArchive, is_archive
+from measurements import Measurements
+
+# Every INDEX_STEP-th row of a csv file is recorded in its time index
+INDEX_STEP = 10_000
+
+# Number of bytes scanned at a time when a time index is built
+BLOCK_SIZE = 16 * 1024 ** 2
+
+# Time indexes built in this process, by file name, size and modification time
+TIME_INDEXES = {}
+
+
+class TimeIndex:
+    """
+    A sparse index of a csv file that is sorted by time: the time and byte offset of every step-th row.
+
+    A time range is located by binary search on the indexed times, so a query only reads the bytes
+    between the indexed rows around it.
+
+    Args:
+        timestamps (numpy array): int64 time in nanoseconds of the indexed rows
+        offsets (numpy array): byte offset of the indexed rows
+        step (int): number of rows between indexed rows
+        size (int): size of the file in bytes
+    """
+
+    def __init__(self, timestamps, offsets, step, size):
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.step = step
+        self.size = size
+        # Without time order the index can not skip anything
+        self.is_sorted = bool(np.all(np.diff(timestamps) >= 0))
+
+    def byte_range(self, start=None, end=None):
+        """
+        Find the bytes of the file holding a time range
+
+        Args:
+            start (str or datetime): first time included
+            end (str or datetime): first time excluded
+        Return:
+            (tuple): the number of the first row in the range of bytes, and its first and last byte offset.
+                The rows in the bytes still have to be filtered on time
+        """
+        if not self.is_sorted:
+            return (0, 0, self.size)
+        first = 0
+        if start is not None:
+            # The last indexed row before start. Every row before it is before start as well
+            first = max(np.searchsorted(self.timestamps, pd.Timestamp(start).value, "left") - 1, 0)
+        last = len(self.offsets)
+        if end is not None:
+            # The first indexed row at or after end. Every row after it is excluded as well
+            last = max(np.searchsorted(self.timestamps, pd.Timestamp(end).value, "left"), first)
+        stop = self.offsets[last] if last < len(self.offsets) else self.size
+        return (int(first * self.step), int(self.offsets[first]) if len(self.offsets) else 0, int(stop))
+
+
+def build_index(filename, step=INDEX_STEP):
+    """
+    Build the time index of a csv file. The file is scanned for line breaks once, and only the
+    indexed rows are parsed. The index is reused until the file changes
+
+    Args:
+        filename (str): the name of the data file
+        step (int): number of rows between indexed rows
+    Return:
+        (TimeIndex): the index of the file
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, step)
+    if key in TIME_INDEXES:
+        return TIME_INDEXES[key]
+
+    offsets = [np.zeros(1, dtype=np.int64)]
+    # Number of the row that starts after the next line break
+    row = 1
+    position = 0
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            starts = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")) + position + 1
+            numbers = np.arange(row, row + len(starts))
+            offsets.append(starts[numbers % step == 0])
+            row += len(starts)
+            position += len(block)
+        offsets = np.concatenate(offsets)
+        # A line break at the end of the file does not start a row
+        offsets = offsets[offsets < position]
+
+        times = []
+        for offset in offsets:
+            file.seek(offset)
+            times.append([int(value) for value in file.readline().split(b",")[:6]])
+
+    timestamps = f.time_index(pd.DataFrame(times, columns=f.TIME_COLUMNS)).asi8 if times else np.empty(0, np.int64)
+    TIME_INDEXES[key] = TimeIndex(timestamps, offsets, step, position)
+    return TIME_INDEXES[key]
+
+
+def read_range(filename, start=None, end=None, zones=None):
+    """
+    Read the rows of a time range and a selection of zones without cleaning them.
+    Csv files are read through their time index, archives through binary search
+
+    Args:
+        filename (str): the name of the data file, a csv file or a binary archive
+        start (str or datetime): first time included
+        end (str or datetime): first time excluded
+        zones (list): the zones to read (see functions.zone_columns). Default is every zone
+    Return:
+        (pandas DataFrame object): time columns and the selected zones, indexed by row number in the file
+    """
+    columns = f.TIME_COLUMNS + f.zone_columns(zones)
+    if is_archive(filename):
+        return MeterArchive(filename).frame(start, end, zones)
+
+    first_row, begin, stop = build_index(filename).byte_range(start, end)
+    with open(filename, "rb") as file:
+        file.seek(begin)
+        text = file.read(stop - begin)
+    if not text.strip():
+        return pd.DataFrame(columns=columns)
+
+    # Only the selected zones are parsed
+    df = pd.read_csv(io.BytesIO(text), header=None, names=f.COLUMNS, usecols=columns)
+    df.index = pd.RangeIndex(first_row, first_row + len(df))
+    timestamps = f.time_index(df[f.TIME_COLUMNS]).asi8
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= timestamps >= pd.Timestamp(start).value
+    if end is not None:
+        keep &= timestamps < pd.Timestamp(end).value
+    return df if keep.all() else df[keep]
+
+
+def query_measurements(filename, fmode, start=None, end=None, zones=None, max_gap=None, return_counts=False):
+    """
+    Load and clean a time range and a selection of zones of a data file. Only the needed rows and
+    zones are read. The rows are cleaned like load_measurements cleans a file, so forward and
+    backward fill look at the first and last row of the range
+
+    Args:
+        filename (str): the name of the data file, a csv file or a binary archive
+        fmode (str): the requested data processing (see load_measurements)
+        start (str or datetime): first time included. Default is the start of the file
+        end (str or datetime): first time excluded. Default is the end of the file
+        zones (list): zone numbers (1 to 4) or column names. Default is every zone
+        max_gap (int): the gap limit of load_measurements
+        return_counts (bool): also return the number of corrupt measurements per zone
+    Return:
+        (tuple): tvec (N x 6 matrix) and data (N x Z matrix) of the range, followed by a Series with
+            the corrupt measurements per zone if return_counts is True
+    """
+    df = read_range(filename, start, end, zones)
+    if len(df) > 0:
+        df, counts = f.clean_measurements(df, fmode, max_gap)
+    else:
+        counts = pd.Series(0, index=df.columns[6:])
+
+    tvec = df.iloc[:, :6]
+    data = df.iloc[:, 6:]
+    if return_counts:
+        return (tvec, data, counts)
+    return (tvec, data)
+
+
+def query_dataset(filename, fmode, start=None, end=None, zones=None, max_gap=None):
+    """
+    Load a time range and a selection of zones of a data file as Measurements
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        start (str or datetime): first time included
+        end (str or datetime): first time excluded
+        zones (list): the zones to load
+        max_gap (int): the gap limit of load_measurements
+    Return:
+        (Measurements): the cleaned measurements of the range
+    """
+    tvec, data, counts = query_measurements(filename, fmode, start, end, zones, max_gap, return_counts=True)
+    dataset = Measurements.from_frames(tvec, data)
+    dataset.corruption_counts = counts
+    return dataset
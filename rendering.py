@@ -0,0 +1,99 @@
+import numpy as np
+
+# Series longer than this are reduced before they are plotted
+DOWNSAMPLE_THRESHOLD = 20_000
+
+
+def minmax_envelope(x, y, buckets):
+    """
+    Reduce a series to the minimum and maximum of each bucket, in time order. Every peak and
+    dip of the original series is kept, so the plotted envelope looks the same at pixel width
+
+    Args:
+        x (numpy array): N sorted x values
+        y (numpy array): N y values
+        buckets (int): number of buckets, e.g. the width of the plot in pixels
+    Return:
+        (tuple): the reduced x and y values (at most 2 * buckets + 2 points)
+    """
+    n = len(y)
+    if n <= 2 * buckets + 2:
+        return (x, y)
+
+    size = n // buckets
+    whole = size * buckets
+    # Ignore missing values when searching for the minimum and maximum
+    low = np.where(np.isnan(y[:whole]), np.inf, y[:whole]).reshape(buckets, size)
+    high = np.where(np.isnan(y[:whole]), -np.inf, y[:whole]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indices = np.concatenate([offsets + low.argmin(axis=1), offsets + high.argmax(axis=1)])
+
+    # The remainder forms a last, smaller bucket and the end points are always kept
+    if whole < n:
+        rest = y[whole:]
+        indices = np.append(indices, [whole + np.where(np.isnan(rest), np.inf, rest).argmin(),
+                                      whole + np.where(np.isnan(rest), -np.inf, rest).argmax()])
+    indices = np.unique(np.concatenate([indices, [0, n - 1]]))
+    return (x[indices], y[indices])
+
+
+class DecimatedLine:
+    """
+    A line plot of a long series that is reduced to a min/max envelope of the visible range at
+    the pixel width of the axes. The envelope is computed again whenever the axes are zoomed or panned
+
+    Args:
+        ax (matplotlib Axes object): the axes to plot on
+        x (numpy array): N sorted x values as numbers (matplotlib date numbers for dates)
+        y (numpy array): N y values
+        **kwargs: passed on to ax.plot
+    """
+
+    def __init__(self, ax, x, y, **kwargs):
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.line, = ax.plot(*self.reduce(x[0], x[-1]), **kwargs)
+        # matplotlib only keeps a weak reference to a bound method, so the line keeps this object alive
+        self.line.decimated = self
+        ax.callbacks.connect("xlim_changed", self.update)
+
+    def reduce(self, start, end):
+        """Envelope of the points between start and end plus one point on each side"""
+        first = max(np.searchsorted(self.x, start) - 1, 0)
+        last = min(np.searchsorted(self.x, end, side="right") + 1, len(self.x))
+        buckets = max(int(self.ax.bbox.width), 1)
+        return minmax_envelope(self.x[first:last], self.y[first:last], buckets)
+
+    def update(self, ax):
+        """Called by matplotlib when the x limits of the axes change"""
+        self.line.set_data(*self.reduce(*ax.get_xlim()))
+        ax.figure.canvas.draw_idle()
+
+
+def plot_line(ax, x, y, downsample=None, **kwargs):
+    """
+    Plot a line. Long series are drawn as a DecimatedLine
+
+    Args:
+        ax (matplotlib Axes object): the axes to plot on
+        x (numpy array): N sorted x values (numbers or datetime64)
+        y (numpy array): N y values
+        downsample (bool): reduce the series to a pixel-width envelope. Default is to reduce
+            series longer than DOWNSAMPLE_THRESHOLD
+        **kwargs: passed on to ax.plot
+    Return:
+        (matplotlib Line2D object): the plotted line
+    """
+    if downsample is None:
+        downsample = len(y) > DOWNSAMPLE_THRESHOLD
+    if not downsample:
+        return ax.plot(x, y, **kwargs)[0]
+
+    if np.issubdtype(x.dtype, np.datetime64):
+        import matplotlib.dates as md
+
+        # Convert once to matplotlib date numbers so the envelope can be searched quickly
+        x = md.date2num(x)
+        ax.xaxis_date()
+    return DecimatedLine(ax, x, np.asarray(y, dtype=np.float64), **kwargs).line
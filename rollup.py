@@ -0,0 +1,255 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import functions as f
+from cache import CACHE_DIR_NAME, cache_key
+from measurements import load_dataset
+from query import query_dataset
+
+# Tiers of the rollup store, from fine to coarse. The minute tier is the cleaned data itself
+TIERS = ["hour", "day", "month"]
+
+# Statistics kept per bucket and zone
+STATISTICS = ["sum", "count", "min", "max"]
+
+
+def roll_up(table, keys):
+    """
+    Combine the buckets of a tier into coarser buckets
+
+    Args:
+        table (dict): sum, count, min and max per bucket, as DataFrames indexed by bucket key
+        keys (numpy array): the coarser bucket of each bucket
+    Return:
+        (dict): sum, count, min and max per coarser bucket
+    """
+    return {"sum": table["sum"].groupby(keys).sum(), "count": table["count"].groupby(keys).sum(),
+            "min": table["min"].groupby(keys).min(), "max": table["max"].groupby(keys).max()}
+
+
+def tier_keys(keys, tier, period):
+    """Convert bucket keys of a tier into the keys of a coarser period"""
+    return f.period_keys(f.period_start(keys, tier), period)
+
+
+def is_aligned(time, tier):
+    """Check if a time is at the start of a bucket of a tier"""
+    timestamp = pd.DatetimeIndex([pd.Timestamp(time)])
+    return f.period_start(f.period_keys(timestamp, tier), tier)[0] == timestamp[0]
+
+
+class RollupStore:
+    """
+    Sums, counts, minima and maxima per zone of every hour, day and month of a dataset.
+
+    Each tier is rolled up from the one below it, so the raw minutes are only grouped once.
+    A query is answered from the coarsest tier that lines up with its time range: day totals
+    over whole months come from the months, and a range starting mid-month from the days.
+    Means, including the hour of the day means, are the stored sums divided by the stored counts.
+
+    Args:
+        tiers (dict): for each tier, a dict of sum, count, min and max per bucket as DataFrames
+            indexed by bucket key (hours, days or months since 1970)
+        corruption_counts (pandas Series object): number of corrupt measurements per zone in the source
+    """
+
+    def __init__(self, tiers, corruption_counts=None):
+        self.tiers = tiers
+        self.corruption_counts = corruption_counts
+
+    @classmethod
+    def build(cls, timestamps, data, corruption_counts=None):
+        """
+        Compute the tiers of a dataset
+
+        Args:
+            timestamps (pandas DatetimeIndex object): N timestamps
+            data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+            corruption_counts (pandas Series object): number of corrupt measurements per zone
+        Return:
+            (RollupStore): the rollups
+        """
+        # The only pass over the raw measurements
+        grouped = data.groupby(f.period_keys(pd.DatetimeIndex(timestamps), "hour"))
+        tiers = {"hour": {"sum": grouped.sum(), "count": grouped.count(), "min": grouped.min(), "max": grouped.max()}}
+        for finer, tier in zip(TIERS, TIERS[1:]):
+            table = tiers[finer]
+            tiers[tier] = roll_up(table, tier_keys(table["sum"].index.to_numpy(), finer, tier))
+        return cls(tiers, corruption_counts)
+
+    def save(self, filename):
+        """
+        Write the rollups as a .npz file
+
+        Args:
+            filename (str): the name of the file
+        """
+        arrays = {"columns": np.array(self.tiers["hour"]["sum"].columns, dtype=str)}
+        if self.corruption_counts is not None:
+            arrays["corruption_counts"] = self.corruption_counts.to_numpy()
+        for tier, table in self.tiers.items():
+            arrays["{}_keys".format(tier)] = table["sum"].index.to_numpy()
+            for statistic in STATISTICS:
+                arrays["{}_{}".format(tier, statistic)] = table[statistic].to_numpy()
+
+        # Write to a temporary file first so a crash never leaves a half written store
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read rollups written by save
+
+        Args:
+            filename (str): the name of the file
+        Return:
+            (RollupStore): the rollups
+        """
+        with np.load(filename) as arrays:
+            columns = list(arrays["columns"])
+            counts = None
+            if "corruption_counts" in arrays:
+                counts = pd.Series(arrays["corruption_counts"], index=columns)
+            tiers = {}
+            for tier in TIERS:
+                index = pd.Index(arrays["{}_keys".format(tier)])
+                tiers[tier] = {statistic: pd.DataFrame(arrays["{}_{}".format(tier, statistic)], index=index,
+                                                       columns=columns) for statistic in STATISTICS}
+        return cls(tiers, counts)
+
+    def tier_for(self, period, start=None, end=None):
+        """
+        Find the coarsest tier that can answer a query
+
+        Args:
+            period (Str): "hour", "day", "month" or "hour of the day"
+            start (str or datetime): first time included
+            end (str or datetime): first time excluded
+        Return:
+            (str): the tier
+        """
+        if period == "hour of the day":
+            candidates = ["hour"]
+        elif period in TIERS:
+            candidates = TIERS[:TIERS.index(period) + 1][::-1]
+        else:
+            raise ValueError("Unknown aggregation period: {}".format(period))
+        for tier in candidates:
+            if all(time is None or is_aligned(time, tier) for time in (start, end)):
+                return tier
+        raise ValueError("The rollups hold whole hours, {} to {} does not start and end on an hour".format(start, end))
+
+    def select(self, tier, start=None, end=None):
+        """
+        Get the buckets of a tier in a time range
+
+        Args:
+            tier (str): "hour", "day" or "month"
+            start (str or datetime): first time included, at the start of a bucket
+            end (str or datetime): first time excluded, at the start of a bucket
+        Return:
+            (dict): sum, count, min and max of the buckets in the range
+        """
+        table = self.tiers[tier]
+        keys = table["sum"].index.to_numpy()
+        keep = np.ones(len(keys), dtype=bool)
+        if start is not None:
+            keep &= keys >= f.period_keys(pd.DatetimeIndex([pd.Timestamp(start)]), tier)[0]
+        if end is not None:
+            keep &= keys < f.period_keys(pd.DatetimeIndex([pd.Timestamp(end)]), tier)[0]
+        if keep.all():
+            return table
+        return {statistic: values[keep] for statistic, values in table.items()}
+
+    def aggregate(self, period, start=None, end=None, statistic="sum"):
+        """
+        Aggregate the dataset from the rollups. Same result as AggregationEngine.aggregate
+
+        Args:
+            period (Str): "hour", "day", "month" or "hour of the day"
+            start (str or datetime): first time included. Must be on an hour
+            end (str or datetime): first time excluded. Must be on an hour
+            statistic (str): "sum", "count", "min", "max" or "mean" of each period.
+                The hour of the day is always the mean
+        Return:
+            tuple: the start of each period (DatetimeIndex) and the aggregated data (DataFrame)
+        """
+        tier = self.tier_for(period, start, end)
+        table = self.select(tier, start, end)
+
+        if period == "hour of the day":
+            hour_of_day = table["sum"].index.to_numpy() % 24
+            data_a = table["sum"].groupby(hour_of_day).sum() / table["count"].groupby(hour_of_day).sum()
+            data_a.index.name = "hour"
+            # Each hour of the day is placed on the first hour with data at that time of day
+            hours = table["sum"].index.to_numpy()
+            first = pd.Series(hours).groupby(hour_of_day).min()
+            return (f.period_start(first[data_a.index].to_numpy(), "hour"), data_a)
+
+        if tier != period:
+            table = roll_up(table, tier_keys(table["sum"].index.to_numpy(), tier, period))
+        if statistic == "mean":
+            values = table["sum"] / table["count"]
+        else:
+            values = table[statistic]
+        return (f.period_start(values.index.to_numpy(), period), values.reset_index(drop=True))
+
+
+def rollup_path(filename, key, cache_dir=None):
+    """
+    Get the path of the rollup store of a data file. The path changes when the file changes
+
+    Args:
+        filename (str): the name of the data file
+        key (str): the data processing the rollups were built with
+        cache_dir (str): directory of the store. Default is the .meter_cache directory next to the file
+    Return:
+        (str): the path of the .npz file
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+    source_key, state_key = cache_key(filename, "rollup|{}".format(key))
+    return os.path.join(cache_dir, "{}-{}-{}.rollup.npz".format(os.path.basename(filename), source_key, state_key))
+
+
+def load_rollups(filename, fmode, max_gap=None, zones=None, cache_dir=None, **kwargs):
+    """
+    Open the rollup store of a data file, building and writing it next to the file first if it
+    is missing or the file has changed
+
+    Args:
+        filename (str): the name of the data file
+        fmode (str): the requested data processing
+        max_gap (int): the gap limit of load_measurements
+        zones (list): only keep these zones. Rows are then only dropped for corrupt measurements in
+            these zones, like query_measurements does, so each selection has its own store
+        cache_dir (str): directory of the store
+        **kwargs: passed on to load_measurements when the store is built (chunksize, engine)
+    Return:
+        (RollupStore): the rollups
+    """
+    key = fmode if max_gap is None else "{}|{}".format(fmode, max_gap)
+    if zones is not None:
+        key = "{}|{}".format(key, ",".join(f.zone_columns(zones)))
+    path = rollup_path(filename, key, cache_dir)
+    if os.path.isfile(path):
+        return RollupStore.load(path)
+
+    if zones is not None:
+        dataset = query_dataset(filename, fmode, zones=zones, max_gap=max_gap)
+    else:
+        dataset = load_dataset(filename, fmode, max_gap=max_gap, **kwargs)
+    store = RollupStore.build(dataset.timestamps, dataset.data, dataset.corruption_counts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Stores built from older versions of the file are removed
+    entry = os.path.basename(path).rsplit("-", 1)[0] + "-"
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(entry) and name != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), name))
+    store.save(path)
+    return store
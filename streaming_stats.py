@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+
+# Quantiles shown by print_statistics
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (a KLL-style hierarchy of compactors).
+
+    Level i holds values that each represent 2^i measurements. When a level holds more than
+    k values it is sorted and every other value is promoted to the next level, so memory stays
+    O(k log(n / k)) while the rank error of a quantile stays below about `error`.
+
+    Args:
+        error (float): target rank error of the quantiles, e.g. 0.01 for 1% of the count
+        seed (int): seed of the random choice between odd and even values when compacting
+    """
+
+    def __init__(self, error=0.01, seed=None):
+        self.error = error
+        self.k = int(np.ceil(2 / error))
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        """
+        Add values to the sketch. NaN values are ignored
+
+        Args:
+            values (numpy array): the new values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compact()
+
+    def merge(self, other):
+        """
+        Add the values of another sketch. Merging is associative, so sketches of chunks or
+        files can be combined in any order
+
+        Args:
+            other (QuantileSketch): the sketch to merge into this one
+        Return:
+            (QuantileSketch): this sketch
+        """
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.compact()
+        return self
+
+    def compact(self):
+        """Promote every other value of each full level to the next level"""
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.k:
+                values = np.sort(values)
+                # Keep one value unpaired if the count is odd
+                keep = values[:len(values) % 2]
+                paired = values[len(values) % 2:]
+                promoted = paired[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """
+        Estimate quantiles
+
+        Args:
+            q (list): the quantiles to estimate, between 0 and 1
+        Return:
+            (numpy array): the estimated value of each quantile
+        """
+        values = np.concatenate(self.levels)
+        if len(values) == 0:
+            return np.full(len(q), np.nan)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        # Midpoint of the rank range covered by each value
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(q, ranks, values)
+
+
+class ColumnStatistics:
+    """
+    Count, minimum, maximum, mean and standard deviation of one column in a single streaming
+    pass, plus quantiles from either all values (exact) or a QuantileSketch
+
+    Args:
+        exact (bool): keep all values so quantiles match DataFrame.describe exactly
+        error (float): target rank error of the sketch when exact is False
+    """
+
+    def __init__(self, exact=False, error=0.01):
+        self.exact = exact
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.values = [] if exact else None
+        self.sketch = None if exact else QuantileSketch(error)
+
+    def update(self, values):
+        """
+        Add values. NaN values are ignored like in DataFrame.describe
+
+        Args:
+            values (numpy array): the new values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self.merge_moments(len(values), mean, ((values - mean) ** 2).sum(), values.min(), values.max())
+        if self.exact:
+            self.values.append(values)
+        else:
+            self.sketch.update(values)
+
+    def merge_moments(self, count, mean, m2, minimum, maximum):
+        """Combine count, mean, sum of squared deviations, minimum and maximum (Chan et al.)"""
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def merge(self, other):
+        """
+        Add the statistics of another part of the data
+
+        Args:
+            other (ColumnStatistics): the statistics to merge into these
+        Return:
+            (ColumnStatistics): these statistics
+        """
+        self.merge_moments(other.count, other.mean, other.m2, other.min, other.max)
+        if self.exact and other.exact:
+            self.values.extend(other.values)
+        else:
+            # Exact values are turned into a sketch when combined with a sketch
+            if self.exact:
+                self.to_sketch(other.sketch.error)
+            if other.exact:
+                for values in other.values:
+                    self.sketch.update(values)
+            else:
+                self.sketch.merge(other.sketch)
+        return self
+
+    def to_sketch(self, error):
+        """Replace the stored values by a sketch"""
+        self.sketch = QuantileSketch(error)
+        for values in self.values:
+            self.sketch.update(values)
+        self.exact = False
+        self.values = None
+
+    def summary(self):
+        """
+        Return:
+            (list): count, mean, std, min, 25%, 50%, 75% and max
+        """
+        if self.count == 0:
+            return [0] + [np.nan] * 7
+        std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        if self.exact:
+            quantiles = np.quantile(np.concatenate(self.values), QUANTILES)
+        else:
+            quantiles = self.sketch.quantile(QUANTILES)
+        return [self.count, self.mean, std, self.min] + list(quantiles) + [self.max]
+
+
+class StreamingStatistics:
+    """
+    Statistics of each zone and of the sum of all zones, computed chunk by chunk.
+
+    Results of different chunks or files can be combined with merge in any order.
+
+    Args:
+        exact (bool): keep all values so the quantiles are exact. Only suitable for small data
+        error (float): target rank error of the quantile sketches when exact is False
+    """
+
+    def __init__(self, exact=False, error=0.01):
+        self.exact = exact
+        self.error = error
+        self.columns = {}
+
+    def update(self, data):
+        """
+        Add a chunk of measurements. The chunk is not modified
+
+        Args:
+            data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        """
+        columns = {column: data[column].to_numpy() for column in data.columns}
+        # The combined consumption of all zones
+        columns["All"] = data.sum(axis=1).to_numpy()
+        for column, values in columns.items():
+            if column not in self.columns:
+                self.columns[column] = ColumnStatistics(self.exact, self.error)
+            self.columns[column].update(values)
+
+    def merge(self, other):
+        """
+        Add the statistics of another chunk or file
+
+        Args:
+            other (StreamingStatistics): the statistics to merge into these
+        Return:
+            (StreamingStatistics): these statistics
+        """
+        for column, statistics in other.columns.items():
+            if column not in self.columns:
+                self.columns[column] = ColumnStatistics(self.exact, self.error)
+            self.columns[column].merge(statistics)
+        return self
+
+    def table(self):
+        """
+        Return:
+            (pandas DataFrame object): one row per zone with the columns of DataFrame.describe
+        """
+        return pd.DataFrame([statistics.summary() for statistics in self.columns.values()],
+                            index=list(self.columns),
+                            columns=["count", "mean", "std", "min", "25%", "50%", "75%", "max"])
+
+
+def compute_statistics(data, exact=True, error=0.01, chunksize=1_000_000):
+    """
+    Compute the statistics of a dataset chunk by chunk
+
+    Args:
+        data (pandas DataFrame object): N x 4 matrix. Each row is a set of measurements
+        exact (bool): compute exact quantiles
+        error (float): target rank error of the quantiles when exact is False
+        chunksize (int): number of rows processed at a time
+    Return:
+        (StreamingStatistics): the statistics
+    """
+    statistics = StreamingStatistics(exact, error)
+    for start in range(0, max(len(data), 1), chunksize):
+        statistics.update(data.iloc[start:start + chunksize])
+    return statistics
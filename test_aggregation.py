@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+import functions as f
+from aggregation import AggregationEngine
+
+
+def test_empty_dataset_aggregates_to_empty():
+    timestamps = pd.DatetimeIndex([], dtype="datetime64[ns]")
+    data = pd.DataFrame(np.empty((0, 4)), columns=f.ZONE_COLUMNS)
+
+    for period, (starts, aggregated) in AggregationEngine(timestamps, data).aggregate_all().items():
+        assert len(starts) == 0 and len(aggregated) == 0, period
+        assert list(aggregated.columns) == f.ZONE_COLUMNS
+
+
+def test_hour_of_day_matches_aggregate_measurements():
+    timestamps = pd.date_range("2006-01-10 22:00", periods=240, freq="min")
+    data = pd.DataFrame(np.ones((240, 4)), columns=f.ZONE_COLUMNS)
+
+    starts, aggregated = AggregationEngine(timestamps, data).aggregate("hour of the day")
+    expected_starts, expected = f.aggregate_measurements(timestamps, data, "hour of the day")
+    # Hours 0 and 1 are first seen on the next day
+    assert list(starts) == list(pd.to_datetime(["2006-01-11 00:00", "2006-01-11 01:00",
+                                                "2006-01-10 22:00", "2006-01-10 23:00"]))
+    assert starts.equals(expected_starts)
+    np.testing.assert_array_equal(aggregated.to_numpy(), expected.to_numpy())
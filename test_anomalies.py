@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomalies import find_runs, rolling_moments, zscores
+
+
+def level_shift_data(rows=50_000, seed=0):
+    """Noisy zones with 5% NaN, a dead stretch and a +1e5 level step"""
+    rng = np.random.default_rng(seed)
+    values = rng.normal(100, 10, (rows, 3))
+    values[rows // 2:] += 1e5
+    values[1000:1100, 1] = 0
+    values[rng.random(values.shape) < 0.05] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("window, min_periods", [(5, 2), (60, None), (60, 10), (1, 1), (7000, 1)])
+def test_rolling_moments_match_pandas(window, min_periods):
+    values = level_shift_data()
+    mean, std = rolling_moments(values, window, min_periods)
+    rolling = pd.DataFrame(values).rolling(window, min_periods=window if min_periods is None else min_periods)
+    np.testing.assert_allclose(mean, rolling.mean().to_numpy(), rtol=1e-10, atol=1e-8)
+    # pandas' online updates leave about 1e-6 of rounding in windows of constant values
+    np.testing.assert_allclose(std, rolling.std().to_numpy(), rtol=1e-6, atol=1e-5)
+
+
+@pytest.mark.parametrize("window, step", [(10_000, 1e5), (60, 1e6)])
+def test_small_noise_after_large_step_is_not_constant(window, step):
+    rng = np.random.default_rng(0)
+    values = rng.normal(100, 0.1, (60_000, 2))
+    values[30_000:] += step
+    mean, std = rolling_moments(values, window)
+    rolling = pd.DataFrame(values).rolling(window)
+    assert (std[window - 1:] > 0).all()
+    np.testing.assert_array_equal(mean, rolling.mean().to_numpy())
+    np.testing.assert_array_equal(std, rolling.std().to_numpy())
+    assert not np.isinf(zscores(values, window)).any()
+
+
+def test_constant_window_is_exact():
+    values = level_shift_data(5000)
+    mean, std = rolling_moments(values, 60, 10)
+    # The dead stretch of zone 2 has no spread and a mean of exactly zero
+    assert (std[1070:1100, 1] == 0).all()
+    assert (mean[1070:1100, 1] == 0).all()
+    # The first measurement after it is an infinite peak
+    first = 1100 + np.flatnonzero(~np.isnan(values[1100:, 1]))[0]
+    assert np.isinf(zscores(values, 60, 10)[first, 1])
+
+
+def test_find_runs():
+    mask = np.array([[1, 0], [1, 0], [0, 1], [1, 1]], dtype=bool)
+    columns, starts, lengths = find_runs(mask)
+    assert list(zip(columns, starts, lengths)) == [(0, 0, 2), (0, 3, 1), (1, 2, 2)]
@@ -0,0 +1,20 @@
+import shutil
+
+import numpy as np
+
+import functions as f
+
+
+def test_cache_keeps_dtypes_apart(tmp_path):
+    filename = shutil.copy("testdata2.csv", tmp_path)
+
+    for _ in range(2):
+        _, data = f.load_measurements(filename, "drop", cache=True)
+        chunked_tvec, chunked = f.load_measurements(filename, "drop", chunksize=2, cache=True)
+        tvec, parsed = f.load_measurements(filename, "drop", engine="numpy", cache=True)
+        assert (data.dtypes == np.float64).all()
+        # Chunks keep compact time columns, the zones are widened back to float64
+        assert chunked_tvec["month"].dtype == np.uint8
+        np.testing.assert_array_equal(chunked.to_numpy(), data.to_numpy())
+        assert (tvec.dtypes == np.int16).all()
+        np.testing.assert_array_equal(parsed.to_numpy(), data.to_numpy())
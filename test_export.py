@@ -0,0 +1,15 @@
+import shutil
+
+from export import make_jobs, render_jobs
+
+
+def test_render_jobs_keeps_order(tmp_path):
+    files = [shutil.copy(name, tmp_path) for name in ["testdata1.csv", "testdata2.csv"]]
+    jobs = make_jobs(files, "drop", ["hour", "day"], ["all"], str(tmp_path / "plots"))
+
+    finished = render_jobs(jobs, workers=2)
+
+    assert [job.output for job in finished] == [job.output for job in jobs]
+    assert all(job.error is None for job in finished)
+    assert all((tmp_path / "plots" / name).is_file() for name in
+               ["testdata1_hour_all.png", "testdata1_day_all.png", "testdata2_hour_all.png", "testdata2_day_all.png"])
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+import measurements
+from archive import convert_csv
+from generate_data import generate_measurements
+from measurements import load_dataset
+
+
+def minute_line(minute):
+    return "2006,1,10,{},{},0,{}.0,2.0,3.0,4.0\n".format(minute // 60, minute % 60, minute % 7)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"engine": "numpy"}, {"engine": "pandas"}, {"engine": "pyarrow"},
+                                    {"chunksize": 7}])
+def test_unfinished_line_is_left_for_append_file(tmp_path, kwargs):
+    if kwargs.get("engine") == "pyarrow":
+        # pyarrow is optional
+        pytest.importorskip("pyarrow")
+    filename = tmp_path / "meter.csv"
+    complete = "".join(minute_line(minute) for minute in range(30)) + "\n"
+    # A writer is in the middle of the next line
+    filename.write_text(complete + minute_line(30)[:9])
+
+    dataset = load_dataset(str(filename), "drop", **kwargs)
+    assert len(dataset) == 30
+    assert dataset.source_offset == len(complete)
+
+    filename.write_text(complete + minute_line(30) + minute_line(31))
+    assert dataset.append_file() == 2
+    assert len(dataset) == 32
+    assert dataset.data.iloc[-2:, 0].tolist() == [2.0, 3.0]
+
+
+@pytest.mark.parametrize("fmode", ["forward fill", "backward fill", "drop", "linear", "zone fill"])
+@pytest.mark.parametrize("corrupt_edges", [False, True])
+def test_archive_loads_like_csv(tmp_path, fmode, corrupt_edges):
+    filename = str(tmp_path / "meter.csv")
+    generate_measurements(filename, 2000, 0.05, corrupt_first=corrupt_edges, corrupt_last=corrupt_edges, seed=1)
+    archive, _ = convert_csv(filename)
+
+    expected = load_dataset(filename, fmode)
+    dataset = load_dataset(archive, fmode)
+    assert dataset.fmode == expected.fmode
+    assert dataset.timestamps.equals(expected.timestamps)
+    # The archive stores the zones as float32
+    np.testing.assert_allclose(dataset.data.to_numpy(), expected.data.to_numpy(), rtol=1e-6)
+
+
+@pytest.mark.parametrize("fmode", ["forward fill", "backward fill", "drop"])
+@pytest.mark.parametrize("source", ["chunks", "archive"])
+def test_float32_loads_keep_file_precision(tmp_path, fmode, source):
+    filename = str(tmp_path / "meter.csv")
+    generate_measurements(filename, 2000, 0.05, seed=4)
+
+    expected = load_dataset(filename, fmode)
+    if source == "chunks":
+        dataset = load_dataset(filename, fmode, chunksize=300)
+    else:
+        dataset = load_dataset(convert_csv(filename)[0], fmode)
+    assert (dataset.data.dtypes == np.float64).all()
+    np.testing.assert_array_equal(dataset.data.to_numpy(), expected.data.to_numpy())
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"chunksize": 100}])
+def test_backward_fill_checks_last_complete_line(tmp_path, kwargs):
+    filename = tmp_path / "meter.csv"
+    lines = [minute_line(minute) for minute in range(300)]
+    lines[-1] = lines[-1].replace(",2.0,", ",-1,")
+    lines[50] = lines[50].replace(",3.0,", ",-1,")
+    # The unfinished line would be a corrupt measurement if it were parsed
+    filename.write_text("".join(lines) + minute_line(300)[:16] + "-")
+
+    dataset = load_dataset(str(filename), "backward fill", **kwargs)
+    assert dataset.fmode == "drop"
+    assert len(dataset) == 298
+
+
+def test_cached_load_does_not_scan_the_file(tmp_path, monkeypatch):
+    filename = tmp_path / "meter.csv"
+    complete = "".join(minute_line(minute) for minute in range(30))
+    filename.write_text(complete + minute_line(30)[:9])
+    first = load_dataset(str(filename), "drop", cache=True)
+
+    def scan(filename):
+        raise AssertionError("the file was scanned")
+
+    monkeypatch.setattr(measurements, "complete_lines", scan)
+    dataset = load_dataset(str(filename), "drop", cache=True)
+    assert dataset.source_offset == first.source_offset == len(complete)
+    assert len(dataset) == len(first) == 30
+
+
+@pytest.mark.parametrize("fmode, max_gap", [("linear", None), ("zone fill", None), ("linear", 3), ("zone fill", 3),
+                                            ("forward fill", 3), ("backward fill", 3)])
+def test_appended_rows_match_reload(tmp_path, fmode, max_gap):
+    source = tmp_path / "source.csv"
+    generate_measurements(str(source), 3000, 0.2, seed=2)
+    lines = source.read_text().splitlines(keepends=True)
+    # Long gaps in every zone, some running across appends
+    for row in range(1200, 1210):
+        values = lines[row].rstrip("\n").split(",")
+        values[6 + row % 4] = "-1"
+        lines[row] = ",".join(values) + "\n"
+    # The loaded part ends on a fully valid row, so its own cleaning does not depend on the rest
+    first = next(row for row in range(1000, 3000) if -1 not in map(float, lines[row].split(",")[6:])) + 1
+
+    filename = tmp_path / "meter.csv"
+    filename.write_text("".join(lines[:first]))
+    dataset = load_dataset(str(filename), fmode, max_gap=max_gap)
+    for end in [first + 1, first + 7, 1205, 1215, 2000, 2999, 3000]:
+        filename.write_text("".join(lines[:end]))
+        dataset.append_file()
+
+    expected = load_dataset(str(filename), fmode, max_gap=max_gap)
+    held_back = len(expected) - len(dataset)
+    assert 0 <= held_back <= 5
+    assert dataset.timestamps.equals(expected.timestamps[:len(dataset)])
+    np.testing.assert_allclose(dataset.data.to_numpy(), expected.data.to_numpy()[:len(dataset)])
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from generate_data import generate_measurements
+from pipeline import Pipeline
+
+
+def write_minutes(path, hours=6):
+    lines = []
+    for minute in range(hours * 60):
+        hour, minute_of_hour = divmod(minute, 60)
+        lines.append("2006,1,10,{},{},0,{}.0,2.0,3.0,4.0".format(hour, minute_of_hour, minute % 7))
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_rollups_fall_back_off_the_hour(tmp_path):
+    filename = tmp_path / "meter.csv"
+    write_minutes(filename)
+
+    rolled = Pipeline(str(filename), rollups=True, start="2006-01-10 01:30")
+    direct = Pipeline(str(filename), start="2006-01-10 01:30")
+    assert not rolled.uses_rollups("hour")
+    assert Pipeline(str(filename), rollups=True, start="2006-01-10 01:00").uses_rollups("hour")
+
+    timestamps, data, unit, scale = rolled.aggregate("hour")
+    expected = direct.aggregate("hour")
+    assert timestamps.equals(expected[0])
+    np.testing.assert_allclose(data.to_numpy(), expected[1].to_numpy())
+
+
+@pytest.mark.parametrize("zones", ["all", "each"])
+def test_plot_hour_of_day_of_part_of_a_day(tmp_path, zones):
+    filename = tmp_path / "meter.csv"
+    write_minutes(filename)
+
+    pipeline = Pipeline(str(filename), end="2006-01-10 05:00")
+    timestamps, data, unit, scale = pipeline.aggregate("hour of the day")
+    assert list(data.index) == [0, 1, 2, 3, 4]
+    output = str(tmp_path / "hours.png")
+    assert pipeline.plot(zones, "hour of the day", output=output) == output
+    assert (tmp_path / "hours.png").is_file()
+
+
+@pytest.mark.parametrize("fmode", ["forward fill", "backward fill", "drop", "linear"])
+@pytest.mark.parametrize("start", [None, "2006-01-02 00:00", "2006-01-02 00:01"])
+def test_rollups_match_direct_with_corrupt_edges(tmp_path, fmode, start):
+    filename = str(tmp_path / "meter.csv")
+    generate_measurements(filename, 4 * 1440, 0.05, corrupt_first=True, corrupt_last=True, seed=3)
+
+    for period in ["hour", "day", "hour of the day"]:
+        timestamps, data, _, _ = Pipeline(filename, fmode, rollups=True, start=start).aggregate(period)
+        expected = Pipeline(filename, fmode, start=start).aggregate(period)
+        assert timestamps.equals(expected[0]), period
+        np.testing.assert_allclose(data.to_numpy(), expected[1].to_numpy(), rtol=1e-9)
@@ -0,0 +1,22 @@
+import gc
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from rendering import plot_line
+
+
+def test_zoom_decimates_visible_range():
+    ax = Figure(figsize=(10, 5)).subplots()
+    x = np.arange(200_000, dtype=np.float64)
+    line = plot_line(ax, x, np.sin(x / 1000), downsample=True)
+    gc.collect()
+
+    before = line.get_xdata()
+    ax.set_xlim(100_000, 101_000)
+    after = line.get_xdata()
+
+    assert before.min() == 0 and before.max() == 199_999
+    # Only the zoomed range plus one point on each side is plotted, at pixel width
+    assert after.min() >= 99_999 and after.max() <= 101_001
+    assert len(after) > 0 and not np.array_equal(before, after)